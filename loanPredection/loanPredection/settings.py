@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'predication.middleware.AdmissionControlMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -118,3 +119,51 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Change feed (/api/changes/) page sizes
+CHANGE_FEED_PAGE_SIZE = 100
+CHANGE_FEED_MAX_PAGE_SIZE = 1000
+
+# Monte Carlo stress test (/api/stress_test/)
+STRESS_TEST_MAX_PATHS = 5000
+STRESS_TEST_WORKERS = None  # process pool size, None = CPU count
+
+# Admission control (predication.middleware.AdmissionControlMiddleware).
+# Per URL name: concurrent slots, wait-queue length, seconds a request may
+# wait for a slot, and the Retry-After sent back when it is turned away.
+# Routes not listed here are never queued. A waiting request holds a server
+# thread, so the uploads fail fast instead of queueing and
+# ADMISSION_MAX_WAITING caps the waiting requests of all routes together;
+# keep it well below the server's threads per worker. The gates only engage
+# with threaded workers (e.g. gunicorn gthread).
+ADMISSION_MAX_WAITING = 4
+ADMISSION_CONTROL = {
+    'upload_loan_data': {'max_concurrent': 1, 'max_queue': 0, 'retry_after': 30},
+    'upload_customer_data': {'max_concurrent': 1, 'max_queue': 0, 'retry_after': 30},
+    # A part PUT holds its thread while it streams up to CHUNKED_UPLOAD_MAX_PART_SIZE
+    'chunked_upload_part': {'max_concurrent': 2, 'max_queue': 0, 'retry_after': 10},
+    'chunked_upload_complete': {'max_concurrent': 1, 'max_queue': 0, 'retry_after': 30},
+    'loan_eligibility': {'max_concurrent': 4, 'max_queue': 2, 'queue_timeout': 2, 'retry_after': 2},
+    'create_new_loan': {'max_concurrent': 4, 'max_queue': 2, 'queue_timeout': 2, 'retry_after': 2},
+    'stress_test': {'max_concurrent': 1, 'max_queue': 0, 'retry_after': 60},
+}
+
+# Idempotency-Key handling for create_new_loan / add_customer
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # seconds a stored response is replayed for
+IDEMPOTENCY_WAIT_TIMEOUT = 30  # seconds a duplicate waits for the first request before a 409
+IDEMPOTENCY_CACHE_MAX_ENTRIES = 10000
+
+# In-memory loan snapshot (predication.snapshot) behind /api/portfolio_summary/:
+# seconds between change-feed polls, and between full rebuilds from the Loan
+# table; how many changed loans it buffers before folding them into its base;
+# and how many of this process's own new events a request applies inline
+LOAN_SNAPSHOT_REFRESH_INTERVAL = 15.0
+LOAN_SNAPSHOT_REBUILD_INTERVAL = 300.0
+LOAN_SNAPSHOT_MAX_DELTA = 10000
+LOAN_SNAPSHOT_INLINE_EVENTS = 1000
+
+# Resumable chunked uploads (/api/uploads/)
+CHUNKED_UPLOAD_DIR = BASE_DIR / 'chunked_uploads'
+CHUNKED_UPLOAD_MAX_PART_SIZE = 64 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_PARTS = 10000
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60  # seconds before an unfinished upload is removed
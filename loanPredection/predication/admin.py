@@ -1,5 +1,21 @@
 from django.contrib import admin
-from .models import Loan, Customer
+from .models import Loan, Customer, ChangeEvent
 
 admin.site.register(Loan)
-admin.site.register(Customer)
\ No newline at end of file
+admin.site.register(Customer)
+
+
+# The change feed is append-only: viewable in the admin, never editable
+@admin.register(ChangeEvent)
+class ChangeEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'table', 'operation', 'object_id', 'created_at')
+    list_filter = ('table', 'operation')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,106 @@
+# Helpers for the change-data feed (ChangeEvent).
+#
+# Writers build unsaved events with loan_change / customer_change and save
+# them with record_changes inside the same transaction as the rows they
+# describe, so the feed never shows a write that was rolled back.
+#
+# Consumers page with "id > cursor", which is only safe if ids become visible
+# in id order. On PostgreSQL an id is handed out at INSERT but only seen at
+# COMMIT, so record_changes takes a transaction-level advisory lock before
+# inserting: the next writer can't get an id until the previous one has
+# committed (or rolled back). Writers batch their events at the end of their
+# transaction, so the lock is only held for the final INSERT and the commit.
+# SQLite already allows a single writer transaction at a time.
+
+from django.db import transaction
+
+from .models import ChangeEvent
+
+
+# Key of the advisory lock that serialises writers of the change feed
+CHANGE_FEED_LOCK_ID = 4_027_001
+
+# Rows per INSERT when a batch of events is saved
+CHANGE_BATCH_SIZE = 1000
+
+
+# Number of committed batches of loan events written by this process. The
+# in-memory loan snapshot compares it with the value it last saw so it can
+# pick up this process's own writes without waiting for its refresh interval.
+local_loan_writes = 0
+
+
+def _loan_writes_committed():
+    global local_loan_writes
+    local_loan_writes += 1
+
+
+def _date(value):
+    # pandas hands us Timestamps, the ORM hands us dates
+    if hasattr(value, 'date') and callable(value.date):
+        value = value.date()
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def loan_payload(loan):
+    return {
+        "loan_id": int(loan.loan_id),
+        "customer_id": int(loan.customer_id),
+        "loan_amount": float(loan.loan_amount),
+        "tenure": int(loan.tenure),
+        "interest_rate": float(loan.interest_rate),
+        "monthly_payment": float(loan.monthly_payment),
+        "emis_paid_on_time": int(loan.emis_paid_on_time),
+        "date_of_approval": _date(loan.date_of_approval),
+        "end_date": _date(loan.end_date),
+    }
+
+
+def customer_payload(customer):
+    return {
+        "customer_id": customer.customer_id,
+        "first_name": customer.first_name,
+        "last_name": customer.last_name,
+        "age": int(customer.age),
+        "phone_number": str(customer.phone_number),
+        "monthly_salary": float(customer.monthly_salary),
+        "approved_limit": float(customer.approved_limit),
+    }
+
+
+def loan_change(loan, operation='create'):
+    return ChangeEvent(table='loan', operation=operation,
+                       object_id=int(loan.loan_id), payload=loan_payload(loan))
+
+
+def customer_change(customer, operation='create'):
+    return ChangeEvent(table='customer', operation=operation,
+                       object_id=customer.customer_id, payload=customer_payload(customer))
+
+
+def _lock_feed():
+    connection = transaction.get_connection()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CHANGE_FEED_LOCK_ID])
+
+
+def record_changes(events):
+    # Saved in batches; the lock is held until the outermost transaction ends
+    if events:
+        with transaction.atomic():
+            _lock_feed()
+            ChangeEvent.objects.bulk_create(events, batch_size=CHANGE_BATCH_SIZE)
+        if any(event.table == 'loan' for event in events):
+            transaction.on_commit(_loan_writes_committed)
+
+
+def event_to_dict(event):
+    return {
+        "cursor": event.id,
+        "table": event.table,
+        "operation": event.operation,
+        "object_id": event.object_id,
+        "payload": event.payload,
+        "created_at": event.created_at.isoformat(),
+    }
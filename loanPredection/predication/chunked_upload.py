@@ -0,0 +1,319 @@
+# Resumable chunked uploads for the loan / customer workbooks.
+#
+# Protocol (all under /api/uploads/):
+#   POST   uploads/                      {"kind": "loan"|"customer", "filename": ...} -> upload_id
+#   PUT    uploads/<id>/parts/<n>/       raw bytes of part n (1-based), X-Part-SHA256 header
+#   GET    uploads/<id>/                 which parts have arrived, to resume after a drop
+#   POST   uploads/<id>/complete/        {"total_parts": N, "sha256": optional} -> ingest
+#
+# Parts are streamed from the request straight to disk and never held in
+# memory. As soon as the next part in order is on disk it is appended to the
+# assembled file, so assembling overlaps the transfer and "complete" only has
+# to append whatever is left and run the ingestion. An .xlsx is a zip whose
+# directory sits at the end of the file, so parsing itself cannot start
+# before the last part arrives.
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from django.conf import settings
+
+from .ingestion import ingest_loan_file, ingest_customer_file
+
+
+INGESTERS = {
+    "loan": ingest_loan_file,
+    "customer": ingest_customer_file,
+}
+
+ALLOWED_EXTENSIONS = ('.xls', '.xlsx')
+
+STREAM_CHUNK = 64 * 1024
+
+
+class ChunkedUploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _root():
+    return Path(getattr(settings, "CHUNKED_UPLOAD_DIR", Path(settings.BASE_DIR) / "chunked_uploads"))
+
+
+def _upload_dir(upload_id):
+    path = _root() / upload_id.hex
+    if not (path / "manifest.json").exists():
+        raise ChunkedUploadError(f"Upload {upload_id} not found", status=404)
+    return path
+
+
+def _read_manifest(path):
+    with open(path / "manifest.json") as f:
+        return json.load(f)
+
+
+def _write_manifest(path, manifest):
+    tmp = path / "manifest.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path / "manifest.json")
+
+
+@contextmanager
+def _locked(path, timeout=30):
+    # Advisory lock on a file shared by every worker process. The OS releases
+    # it when the holder closes the file or dies, so a lock is never broken
+    # by age, however long the holder takes; timeout only bounds our wait.
+    deadline = time.monotonic() + timeout
+    try:
+        lock = open(path / "lock", "a+b")
+    except FileNotFoundError:
+        raise ChunkedUploadError(f"Upload {path.name} not found", status=404)
+    with lock:
+        while not _try_lock(lock):
+            if time.monotonic() >= deadline:
+                raise ChunkedUploadError("Upload is busy, please retry", status=409)
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            _unlock(lock)
+
+
+if fcntl is not None:
+    def _try_lock(f):
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _unlock(f):
+        fcntl.flock(f, fcntl.LOCK_UN)
+else:
+    def _try_lock(f):
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _mtime(path):
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return time.time()
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _part_path(path, number):
+    return path / "parts" / f"{number}.part"
+
+
+def _assembled_path(path, manifest):
+    return path / ("assembled" + manifest["extension"])
+
+
+def _append_ready_parts(path, manifest):
+    # Move every part that is next in order onto the end of the assembled file
+    assembled = _assembled_path(path, manifest)
+    with open(assembled, "ab") as out:
+        while True:
+            part = _part_path(path, manifest["assembled_parts"] + 1)
+            if not part.exists():
+                break
+            with open(part, "rb") as src:
+                shutil.copyfileobj(src, out, STREAM_CHUNK)
+            manifest["assembled_parts"] += 1
+            manifest["assembled_bytes"] = out.tell()
+            _write_manifest(path, manifest)
+            _unlink(part)
+
+
+def _ingesting(path, manifest):
+    # "ingesting" is only true while some worker holds the lock, since the
+    # ingestion runs under it; a worker that died mid-ingest leaves the state
+    # behind but the OS has dropped its lock, and the upload is usable again
+    if manifest.get("state") != "ingesting":
+        return False
+    try:
+        with _locked(path, timeout=0):
+            return False
+    except ChunkedUploadError:
+        return True
+
+
+def _check_not_ingesting(path, manifest):
+    if _ingesting(path, manifest):
+        raise ChunkedUploadError("Upload is already being ingested", status=409)
+
+
+def _sweep_expired():
+    root = _root()
+    if not root.exists():
+        return
+    cutoff = time.time() - getattr(settings, "CHUNKED_UPLOAD_EXPIRY", 24 * 60 * 60)
+    for path in root.iterdir():
+        if path.is_dir() and _mtime(path / "manifest.json") < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# Function to start a new upload
+def init_upload(kind, filename):
+    if kind not in INGESTERS:
+        raise ChunkedUploadError(f"kind must be one of: {', '.join(INGESTERS)}")
+    if not filename or not filename.endswith(ALLOWED_EXTENSIONS):
+        raise ChunkedUploadError('Invalid file format. Please upload an Excel file (.xls or .xlsx)')
+
+    _sweep_expired()
+    upload_id = uuid.uuid4()
+    path = _root() / upload_id.hex
+    (path / "parts").mkdir(parents=True)
+    _write_manifest(path, {
+        "kind": kind,
+        "filename": filename,
+        "extension": os.path.splitext(filename)[1],
+        "assembled_parts": 0,
+        "assembled_bytes": 0,
+        "state": "receiving",
+    })
+    return {
+        "upload_id": str(upload_id),
+        "max_part_size": getattr(settings, "CHUNKED_UPLOAD_MAX_PART_SIZE", 64 * 1024 * 1024),
+    }
+
+
+# Function to store one part, streaming it from the request to disk
+def store_part(upload_id, number, stream, length, checksum):
+    path = _upload_dir(upload_id)
+    max_part_size = getattr(settings, "CHUNKED_UPLOAD_MAX_PART_SIZE", 64 * 1024 * 1024)
+    max_parts = getattr(settings, "CHUNKED_UPLOAD_MAX_PARTS", 10000)
+    if not 1 <= number <= max_parts:
+        raise ChunkedUploadError(f"Part number must be between 1 and {max_parts}")
+    if not checksum:
+        raise ChunkedUploadError("Missing X-Part-SHA256 header")
+    if length is None or length <= 0:
+        raise ChunkedUploadError("Content-Length is required")
+    if length > max_part_size:
+        raise ChunkedUploadError(f"Part is larger than {max_part_size} bytes", status=413)
+
+    manifest = _read_manifest(path)
+    _check_not_ingesting(path, manifest)
+    if number <= manifest["assembled_parts"]:
+        # Already received and assembled; a retry of a part that made it
+        return {"part_number": number, "size": length, "status": "already assembled"}
+
+    # Write to a temporary name and only rename once the checksum matches,
+    # so a dropped connection never leaves a half-written part behind
+    tmp = path / "parts" / f"{number}.{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with open(tmp, "wb") as out:
+            while received < length:
+                chunk = stream.read(min(STREAM_CHUNK, length - received))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                received += len(chunk)
+        if received != length:
+            raise ChunkedUploadError(f"Expected {length} bytes, received {received}")
+        if digest.hexdigest() != checksum.lower():
+            raise ChunkedUploadError(f"Checksum mismatch for part {number}", status=422)
+        os.replace(tmp, _part_path(path, number))
+    finally:
+        _unlink(tmp)
+
+    with _locked(path):
+        manifest = _read_manifest(path)
+        _append_ready_parts(path, manifest)
+
+    return {"part_number": number, "size": received, "assembled_parts": manifest["assembled_parts"]}
+
+
+# Function to report what has arrived so a client can resume
+def upload_status(upload_id):
+    path = _upload_dir(upload_id)
+    manifest = _read_manifest(path)
+    pending = sorted(int(p.stem) for p in (path / "parts").glob("*.part"))
+    state = manifest.get("state", "receiving")
+    if state == "ingesting" and not _ingesting(path, manifest):
+        state = "assembled"  # left behind by a worker that died mid-ingest
+    return {
+        "upload_id": str(upload_id),
+        "kind": manifest["kind"],
+        "filename": manifest["filename"],
+        "assembled_parts": manifest["assembled_parts"],
+        "assembled_bytes": manifest["assembled_bytes"],
+        "pending_parts": pending,
+        "state": state,
+    }
+
+
+# Function to finish the upload and feed the file to the ingestion logic
+def complete_upload(upload_id, total_parts, sha256=None):
+    path = _upload_dir(upload_id)
+    # Fail fast instead of waiting out the lock while another call ingests
+    _check_not_ingesting(path, _read_manifest(path))
+
+    # The lock is held for the whole ingestion, so a second "complete" (or a
+    # late part) can't touch the file meanwhile, and if this worker dies the
+    # OS releases it and the upload can be completed again
+    with _locked(path):
+        manifest = _read_manifest(path)
+        _append_ready_parts(path, manifest)
+        if manifest["assembled_parts"] != total_parts:
+            raise ChunkedUploadError(
+                f"Missing part {manifest['assembled_parts'] + 1}; "
+                f"{manifest['assembled_parts']} of {total_parts} parts assembled", status=409)
+
+        assembled = _assembled_path(path, manifest)
+        if sha256:
+            digest = hashlib.sha256()
+            with open(assembled, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            if digest.hexdigest() != sha256.lower():
+                raise ChunkedUploadError("Checksum mismatch for the assembled file", status=422)
+
+        # Lets status and part uploads tell a running ingestion apart
+        manifest["state"] = "ingesting"
+        _write_manifest(path, manifest)
+
+        status_code = None
+        try:
+            response_data, status_code = INGESTERS[manifest["kind"]](str(assembled))
+        finally:
+            if status_code is None or status_code >= 400:
+                manifest["state"] = "assembled"
+                _write_manifest(path, manifest)
+
+    if status_code < 400:
+        shutil.rmtree(path, ignore_errors=True)
+    return response_data, status_code
@@ -0,0 +1,210 @@
+# Idempotency-Key support for the write endpoints.
+#
+# The first response for a (view, key) pair is stored in IdempotencyKey and
+# in a small in-memory cache, and later requests with the same key get that
+# response back without running the view again.
+#
+# The key row is inserted, the view runs and the row is filled in with the
+# response all inside one transaction, so the key and the view's writes are
+# committed together or not at all: a worker dying half-way leaves nothing
+# behind and the retry simply runs again. Concurrent duplicates are
+# coalesced: inside a process they wait on the thread that got there first;
+# in another process their INSERT of the same key blocks on the unique index
+# until the first transaction ends, and then they replay its row. Both waits
+# are bounded by IDEMPOTENCY_WAIT_TIMEOUT, after which the duplicate gets
+# 409 with Retry-After; the first request is never taken over.
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+
+def _ttl():
+    return getattr(settings, "IDEMPOTENCY_KEY_TTL", 24 * 60 * 60)
+
+
+def _wait_timeout():
+    # How long a duplicate waits for the first request before giving up
+    return getattr(settings, "IDEMPOTENCY_WAIT_TIMEOUT", 30)
+
+
+# (endpoint, key) -> (expires_at, request_hash, status_code, body, content_type)
+_cache = OrderedDict()
+_in_flight = {}
+_lock = threading.Lock()
+
+
+def _cache_get(cache_key):
+    with _lock:
+        entry = _cache.get(cache_key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _cache[cache_key]
+            return None
+        return entry
+
+
+def _cache_put(cache_key, request_hash, status_code, body, content_type, expires_in):
+    with _lock:
+        _cache[cache_key] = (time.monotonic() + expires_in, request_hash, status_code, body, content_type)
+        _cache.move_to_end(cache_key)
+        # Drop expired entries from the front, then the oldest ones over the cap
+        now = time.monotonic()
+        max_entries = getattr(settings, "IDEMPOTENCY_CACHE_MAX_ENTRIES", 10000)
+        while _cache:
+            oldest_key, oldest = next(iter(_cache.items()))
+            if oldest[0] > now and len(_cache) <= max_entries:
+                break
+            del _cache[oldest_key]
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+def _replay(entry, request_hash):
+    _, stored_hash, status_code, body, content_type = entry
+    if stored_hash != request_hash:
+        return JsonResponse({
+            "error": "Idempotency-Key was already used with a different request body"
+        }, status=422)
+    response = HttpResponse(body, status=status_code, content_type=content_type)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _entry_from_row(row):
+    remaining = _ttl() - (timezone.now() - row.created_at).total_seconds()
+    return (time.monotonic() + remaining, row.request_hash, row.status_code,
+            row.response_body, row.content_type)
+
+
+def _still_running():
+    response = JsonResponse({
+        "error": "A request with this Idempotency-Key is still being processed"
+    }, status=409)
+    response["Retry-After"] = "1"
+    return response
+
+
+def _set_lock_timeout(seconds):
+    # Bounds how long our INSERT waits on another transaction holding the same
+    # key (PostgreSQL; SQLite has a single writer and its own busy timeout)
+    connection = transaction.get_connection()
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            if seconds is None:
+                cursor.execute("SET LOCAL lock_timeout TO DEFAULT")
+            else:
+                cursor.execute("SET LOCAL lock_timeout = %s", [f"{int(seconds * 1000)}ms"])
+
+
+def _is_lock_timeout(error):
+    return getattr(error.__cause__, "pgcode", None) == "55P03"
+
+
+def _run_once(view, request, args, kwargs, endpoint, key, request_hash):
+    """Run the view under the key, or return the entry of the request that already did.
+
+    Returns (response, entry); exactly one of them is set.
+    """
+    with transaction.atomic():
+        row = IdempotencyKey.objects.filter(endpoint=endpoint, key=key).first()
+        if row is not None and row.created_at < timezone.now() - timedelta(seconds=_ttl()):
+            # Expired: the key may be reused
+            row.delete()
+            row = None
+
+        if row is None:
+            try:
+                _set_lock_timeout(_wait_timeout())
+                with transaction.atomic():
+                    IdempotencyKey.objects.create(endpoint=endpoint, key=key,
+                                                  request_hash=request_hash, created_at=timezone.now())
+            except IntegrityError:
+                # A concurrent request with the key committed while we waited
+                row = IdempotencyKey.objects.get(endpoint=endpoint, key=key)
+            finally:
+                _set_lock_timeout(None)
+
+        if row is not None:
+            return None, _entry_from_row(row)
+
+        response = view(request, *args, **kwargs)
+        if response.status_code >= 500:
+            # Server errors are not stored, and whatever the view wrote is
+            # rolled back with the key, so the client can retry cleanly
+            transaction.set_rollback(True)
+        else:
+            IdempotencyKey.objects.filter(endpoint=endpoint, key=key).update(
+                status_code=response.status_code,
+                response_body=response.content.decode(response.charset),
+                content_type=response.get("Content-Type", "application/json"),
+            )
+        return response, None
+
+
+def idempotent(view):
+    """Replay the stored response for requests carrying a known Idempotency-Key."""
+    endpoint = view.__name__
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if request.method != "POST" or not key:
+            return view(request, *args, **kwargs)
+        if len(key) > 255:
+            return JsonResponse({"error": "Idempotency-Key must be at most 255 characters"}, status=400)
+
+        cache_key = (endpoint, key)
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        deadline = time.monotonic() + _wait_timeout()
+
+        # Duplicates inside this process wait for the first one to finish
+        while True:
+            entry = _cache_get(cache_key)
+            if entry is not None:
+                return _replay(entry, request_hash)
+            with _lock:
+                event = _in_flight.get(cache_key)
+                if event is None:
+                    event = _in_flight[cache_key] = threading.Event()
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not event.wait(remaining):
+                return _still_running()
+
+        try:
+            try:
+                response, entry = _run_once(view, request, args, kwargs, endpoint, key, request_hash)
+            except OperationalError as e:
+                if _is_lock_timeout(e):
+                    return _still_running()
+                raise
+
+            if entry is not None:
+                _cache_put(cache_key, *entry[1:], expires_in=entry[0] - time.monotonic())
+                return _replay(entry, request_hash)
+            if response.status_code < 500:
+                _cache_put(cache_key, request_hash, response.status_code,
+                           response.content.decode(response.charset),
+                           response.get("Content-Type", "application/json"), expires_in=_ttl())
+            return response
+        finally:
+            with _lock:
+                _in_flight.pop(cache_key, None)
+            event.set()
+
+    return wrapper
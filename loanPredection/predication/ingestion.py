@@ -0,0 +1,142 @@
+# Ingestion of the loan / customer Excel workbooks.
+#
+# pandas and openpyxl are heavy to import, so they are only loaded inside the
+# functions below. Importing this module (or views.py) stays cheap and workers
+# only pay for the parsing stack the first time an upload actually comes in.
+
+from itertools import islice
+
+from django.db import transaction
+
+from .models import Loan, Customer
+from .changes import loan_change, customer_change, record_changes
+
+
+CUSTOMER_COLUMNS = ['Customer ID', 'First Name', 'Last Name', 'Age',
+                    'Phone Number', 'Monthly Salary', 'Approved Limit']
+
+# Rows committed per transaction. Large workbooks are not loaded in one long
+# transaction: that would hold locks for the whole file and pile up
+# savepoints, which slows every concurrent reader on PostgreSQL.
+INGEST_BATCH_SIZE = 1000
+
+
+def _batches(rows):
+    rows = iter(rows)
+    while batch := list(islice(rows, INGEST_BATCH_SIZE)):
+        yield batch
+
+
+# Function to load the loan workbook into the Loan table
+def ingest_loan_file(file):
+    import pandas as pd
+
+    # Load the Excel file
+    df = pd.read_excel(file)
+
+    # Iterate over rows and save each record to the database, committing every
+    # INGEST_BATCH_SIZE rows together with their change events. Each row gets
+    # a savepoint: a bad row stops the upload but, as before, the rows ahead
+    # of it stay saved.
+    for batch in _batches(df.iterrows()):
+        changes = []
+        error = None
+        with transaction.atomic():
+            for _, row in batch:
+                try:
+                    with transaction.atomic():
+                        loan, created = Loan.objects.get_or_create(
+                            loan_id=row["Loan ID"],  # Use loan_id as the unique identifier
+                            defaults={
+                                "customer_id": row["Customer ID"],
+                                "loan_amount": row["Loan Amount"],
+                                "tenure": row["Tenure"],
+                                "interest_rate": row["Interest Rate"],
+                                "monthly_payment": row["Monthly payment"],
+                                "emis_paid_on_time": row["EMIs paid on Time"],
+                                "date_of_approval": row["Date of Approval"],
+                                "end_date": row["End Date"],
+                            },
+                        )
+                except Exception as e:
+                    error = e
+                    break
+                if created:
+                    changes.append(loan_change(loan))
+            record_changes(changes)
+        if error is not None:
+            raise error
+    return {"message": "Data uploaded successfully"}, 201
+
+
+# Function to load the customer workbook into the Customer table
+def ingest_customer_file(file):
+    import openpyxl
+
+    # Load the Excel file
+    wb = openpyxl.load_workbook(file)
+    sheet = wb.active
+
+    # Get headers to verify column names
+    headers = [cell.value for cell in sheet[1]]
+
+    # Verify all required columns are present
+    missing_columns = [col for col in CUSTOMER_COLUMNS if col not in headers]
+    if missing_columns:
+        return {
+            'error': f'Missing required columns: {", ".join(missing_columns)}'
+        }, 400
+
+    # Track successful and failed records
+    success_count = 0
+    failed_records = []
+
+    # Skip the header row and iterate through the data, committing every
+    # INGEST_BATCH_SIZE rows together with their change events.
+    # update_or_create runs in its own savepoint, so a bad row doesn't abort
+    # its batch.
+    rows = enumerate(sheet.iter_rows(min_row=2, values_only=True), 2)
+    for batch in _batches(rows):
+        changes = []
+        with transaction.atomic():
+            for row_num, row in batch:
+                try:
+                    customer_id, first_name, last_name, age, phone_number, monthly_salary, approved_limit = row
+
+                    # Basic validation
+                    if not all([first_name, last_name, age, phone_number, monthly_salary]):
+                        failed_records.append(f"Row {row_num}: Missing required fields")
+                        continue
+
+                    # Create or update customer
+                    customer, created = Customer.objects.update_or_create(
+                        phone_number=phone_number,  # Using phone_number as unique identifier
+                        defaults={
+                            'first_name': first_name,
+                            'last_name': last_name,
+                            'age': age,
+                            'monthly_salary': monthly_salary,
+                            'approved_limit': approved_limit if approved_limit else round((36 * float(monthly_salary)) / 100000) * 100000,
+                        }
+                    )
+                    changes.append(customer_change(customer, 'create' if created else 'update'))
+                    success_count += 1
+
+                except Exception as e:
+                    failed_records.append(f"Row {row_num}: {str(e)}")
+
+            record_changes(changes)
+
+    # Prepare response
+    response_data = {
+        'message': f'Successfully processed {success_count} records',
+        'total_rows': sheet.max_row - 1,  # Excluding header
+        'successful_records': success_count,
+        'failed_records': len(failed_records),
+    }
+
+    if failed_records:
+        response_data['errors'] = failed_records
+
+    status_code = 200 if success_count > 0 else 400
+    return response_data, status_code
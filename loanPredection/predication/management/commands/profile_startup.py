@@ -0,0 +1,110 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Modules a worker imports while serving requests, plus the parsing stack that
+# should only be pulled in by the upload endpoints.
+DEFAULT_MODULES = [
+    'loanPredection.urls',
+    'predication.urls',
+    'predication.views',
+    'predication.ingestion',
+    'pandas',
+    'openpyxl',
+]
+
+# Runs in a fresh interpreter so every module is measured cold. Django is set
+# up first, the same way a worker boots, and only the import of the target
+# module is timed.
+PROBE = r'''
+import importlib, json, os, sys, time
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage // 1024 if sys.platform == 'darwin' else usage
+    except ImportError:
+        return None
+
+import django
+django.setup()
+
+module = sys.argv[1]
+already_loaded = set(sys.modules)
+rss_before = rss_kb()
+start = time.perf_counter()
+importlib.import_module(module)
+elapsed = time.perf_counter() - start
+rss_after = rss_kb()
+
+print(json.dumps({
+    'module': module,
+    'import_ms': elapsed * 1000,
+    'rss_kb': None if rss_before is None else rss_after - rss_before,
+    'total_rss_kb': rss_after,
+    'new_modules': len(set(sys.modules) - already_loaded),
+    'loads_pandas': 'pandas' in sys.modules and 'pandas' not in already_loaded,
+    'loads_openpyxl': 'openpyxl' in sys.modules and 'openpyxl' not in already_loaded,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = "Report cold import time and RSS growth per module, as a worker would see them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*', help="Modules to profile (defaults to the app's request path)")
+        parser.add_argument('--max-ms', type=float, help="Fail if any module takes longer than this to import")
+        parser.add_argument('--max-rss-kb', type=int, help="Fail if any module grows RSS by more than this")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or DEFAULT_MODULES
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE))
+
+        results = []
+        for module in modules:
+            proc = subprocess.run(
+                [sys.executable, '-c', PROBE, module],
+                capture_output=True, text=True, env=env, cwd=str(settings.BASE_DIR),
+            )
+            if proc.returncode != 0:
+                raise CommandError(f"Could not import {module}:\n{proc.stderr.strip()}")
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.stdout.write(f"{'module':<28}{'import ms':>12}{'rss kb':>10}{'modules':>9}  heavy deps")
+            for result in results:
+                heavy = [name for name in ('pandas', 'openpyxl') if result[f'loads_{name}']]
+                rss = '-' if result['rss_kb'] is None else result['rss_kb']
+                self.stdout.write(
+                    f"{result['module']:<28}{result['import_ms']:>12.1f}{rss:>10}"
+                    f"{result['new_modules']:>9}  {', '.join(heavy) or '-'}"
+                )
+
+        # Budget checks so this can run in CI and catch import regressions
+        failures = []
+        for result in results:
+            if options['max_ms'] is not None and result['import_ms'] > options['max_ms']:
+                failures.append(f"{result['module']} took {result['import_ms']:.1f} ms")
+            if (options['max_rss_kb'] is not None and result['rss_kb'] is not None
+                    and result['rss_kb'] > options['max_rss_kb']):
+                failures.append(f"{result['module']} added {result['rss_kb']} kB RSS")
+        if failures:
+            raise CommandError("Startup budget exceeded: " + "; ".join(failures))
@@ -0,0 +1,160 @@
+# Admission control for the expensive endpoints.
+#
+# Each route named in settings.ADMISSION_CONTROL gets a gate with a fixed
+# number of concurrent slots and a bounded wait queue. When the queue is
+# full the request is turned away straight away with 429; when it waits in
+# the queue longer than queue_timeout it gets 503. Both carry Retry-After.
+# Routes without an entry (e.g. the view_loan_* reads) are never held back,
+# so a bulk upload can only use up its own slots.
+#
+# A queued request holds a server thread while it waits. To keep the queues
+# from eating the threads the cheap reads need, the total number of waiting
+# requests in a process is capped by ADMISSION_MAX_WAITING on top of each
+# route's max_queue; beyond that requests fail fast with 429. Keep that cap
+# well below the server's threads per worker.
+#
+# Gates are per process: with N workers the effective limit is N times the
+# configured one. The gates only see concurrency inside one process, so they
+# have no effect under sync workers (one request per process at a time); run
+# with threads (e.g. gunicorn --worker-class gthread --threads 16) for them
+# to engage.
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_LIMITS = {
+    "max_concurrent": 4,
+    "max_queue": 0,
+    "queue_timeout": 2,
+    "retry_after": 5,
+}
+
+
+class RouteGate:
+    def __init__(self, route, max_concurrent, max_queue, queue_timeout, retry_after, waiting_slots=None):
+        self.route = route
+        # Semaphore shared by all gates of the process, bounding waiting threads
+        self.waiting_slots = waiting_slots
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._condition = threading.Condition()
+        self.active = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def acquire(self):
+        """Take a slot. Returns None when admitted, else the status to reject with."""
+        with self._condition:
+            if self.active < self.max_concurrent:
+                self.active += 1
+                self.admitted += 1
+                return None
+
+            if self.queued >= self.max_queue or (
+                    self.waiting_slots is not None and not self.waiting_slots.acquire(blocking=False)):
+                self.rejected_queue_full += 1
+                return 429
+
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        return 503
+                    self._condition.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return None
+            finally:
+                self.queued -= 1
+                if self.waiting_slots is not None:
+                    self.waiting_slots.release()
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout,
+            }
+
+
+# Gates of the running process, keyed by URL name. Built once from settings
+# and shared by every handler in the process (and the stats view).
+gates = {}
+_gates_lock = threading.Lock()
+
+
+def get_gates():
+    with _gates_lock:
+        if not gates:
+            waiting_slots = threading.BoundedSemaphore(getattr(settings, "ADMISSION_MAX_WAITING", 4))
+            for route, limits in getattr(settings, "ADMISSION_CONTROL", {}).items():
+                gates[route] = RouteGate(route, **{**DEFAULT_LIMITS, **(limits or {})},
+                                         waiting_slots=waiting_slots)
+        return gates
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.gates = get_gates()
+
+    def __call__(self, request):
+        gate = self._gate_for(request)
+        if gate is None:
+            return self.get_response(request)
+
+        status = gate.acquire()
+        if status is not None:
+            logger.warning(
+                "Rejected %s with %s (active=%s queued=%s)",
+                request.path, status, gate.active, gate.queued,
+            )
+            response = JsonResponse({
+                "error": "Too many requests, please retry later" if status == 429
+                else "Service busy, please retry later",
+            }, status=status)
+            response["Retry-After"] = str(gate.retry_after)
+            return response
+
+        try:
+            return self.get_response(request)
+        finally:
+            gate.release()
+
+    def _gate_for(self, request):
+        if not self.gates:
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return self.gates.get(match.url_name)
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predication', '0004_alter_customer_customer_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('table', models.CharField(choices=[('loan', 'Loan'), ('customer', 'Customer')], max_length=20)),
+                ('operation', models.CharField(choices=[('create', 'Create'), ('update', 'Update')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['table', 'id'], name='predication_table_72efe3_idx')],
+            },
+        ),
+    ]
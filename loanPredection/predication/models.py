@@ -28,3 +28,46 @@ class Customer(models.Model):
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
+
+
+class ChangeEvent(models.Model):
+    # Append-only log of writes to Loan / Customer. The auto-increment id is
+    # the cursor consumers pass back to /changes/?since=<id>.
+    TABLE_CHOICES = [('loan', 'Loan'), ('customer', 'Customer')]
+    OPERATION_CHOICES = [('create', 'Create'), ('update', 'Update')]
+
+    id = models.BigAutoField(primary_key=True)
+    table = models.CharField(max_length=20, choices=TABLE_CHOICES)
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES)
+    object_id = models.BigIntegerField()
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['table', 'id'])]
+
+    def __str__(self):
+        return f"{self.operation} {self.table} {self.object_id} (#{self.id})"
+
+
+class IdempotencyKey(models.Model):
+    # First response of a create_new_loan / add_customer call made with an
+    # Idempotency-Key header. The row is inserted and filled in within the
+    # same transaction as the view's writes, so other workers only ever see
+    # it once the response is stored.
+    endpoint = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key}"
@@ -0,0 +1,341 @@
+# In-process columnar snapshot of the Loan table, for portfolio analytics.
+#
+# The snapshot is a base plus a delta. The base is every loan as one
+# position in a set of NumPy columns sorted by customer_id, with an offset
+# index (customers / offsets) so a customer's loans are one contiguous
+# slice. It is built from the database and never modified. Loan events from
+# the change feed (ChangeEvent rows with table='loan') go into the delta: the
+# newest version of each changed loan, appended in bulk, plus the sorted
+# positions of the base rows they replace ("dead"). Applying a batch of
+# events costs O(delta + batch), not O(book); readers combine the live base
+# rows with the delta.
+#
+# Reads never touch the ORM and are never used for credit decisions, which
+# read the database (see views.customers_with_credit_aggregates); the
+# snapshot lags the feed by up to LOAN_SNAPSHOT_REFRESH_INTERVAL seconds.
+#
+# Only the first build runs on a request. After that a daemon thread per
+# process applies new events every LOAN_SNAPSHOT_REFRESH_INTERVAL seconds
+# (in pages of LOAN_SNAPSHOT_MAX_DELTA), folds the delta into a new base
+# once it holds more than LOAN_SNAPSHOT_MAX_DELTA loans, and rebuilds from
+# the table every LOAN_SNAPSHOT_REBUILD_INTERVAL seconds to catch writes that
+# bypass the feed (admin edits, deletes). A request that follows a loan
+# write by this process applies up to LOAN_SNAPSHOT_INLINE_EVENTS pending
+# events itself and hands anything beyond that to the thread.
+
+import logging
+import threading
+import time
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from . import changes
+from .models import ChangeEvent, Loan
+
+logger = logging.getLogger(__name__)
+
+
+COLUMNS = {
+    "loan_id": np.int64,
+    "customer_id": np.int64,
+    "loan_amount": np.float64,
+    "interest_rate": np.float64,
+    "tenure": np.int32,
+    "monthly_payment": np.float64,
+    "emis_paid_on_time": np.int32,
+    "date_of_approval": "datetime64[D]",
+    "end_date": "datetime64[D]",
+}
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _days(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal() - _EPOCH_ORDINAL
+
+
+def _empty_columns(size=0):
+    return {name: np.empty(size, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+
+def _columns_from_rows(rows, size):
+    # rows: iterable of tuples in COLUMNS order, dates as date or ISO string
+    columns = _empty_columns(size)
+    days = {name: np.empty(size, dtype=np.int64) for name in ("date_of_approval", "end_date")}
+    count = 0
+    for i, row in enumerate(rows):
+        if i >= size:
+            break
+        (columns["loan_id"][i], columns["customer_id"][i], columns["loan_amount"][i],
+         columns["interest_rate"][i], columns["tenure"][i], columns["monthly_payment"][i],
+         columns["emis_paid_on_time"][i]) = row[:7]
+        days["date_of_approval"][i] = _days(row[7])
+        days["end_date"][i] = _days(row[8])
+        count = i + 1
+    columns = {name: column[:count] for name, column in columns.items()}
+    for name, values in days.items():
+        columns[name] = values[:count].astype("datetime64[D]")
+    return columns
+
+
+def _approval_years(column):
+    return column.astype("datetime64[Y]").astype(np.int64) + 1970
+
+
+class LoanSnapshot:
+    def __init__(self, columns, cursor, delta=None, dead=None):
+        # columns must be sorted by customer_id; they are shared, not copied,
+        # by every snapshot derived from this one
+        self.columns = columns
+        self.cursor = cursor
+        self.delta = delta if delta is not None else _empty_columns()
+        self.dead = dead if dead is not None else np.empty(0, dtype=np.int64)
+        self._index()
+
+    def _index(self):
+        self.customers, starts = np.unique(self.columns["customer_id"], return_index=True)
+        self.offsets = np.append(starts, len(self.columns["customer_id"]))
+        # Positions of the base rows in loan_id order, to find replaced loans
+        self._by_loan_id = np.argsort(self.columns["loan_id"], kind="stable")
+        self._loan_ids = self.columns["loan_id"][self._by_loan_id]
+
+    def _derive(self, cursor, delta, dead):
+        snapshot = object.__new__(LoanSnapshot)
+        snapshot.__dict__.update(self.__dict__)
+        snapshot.cursor, snapshot.delta, snapshot.dead = cursor, delta, dead
+        return snapshot
+
+    @classmethod
+    def from_rows(cls, rows, cursor=0):
+        rows = sorted(rows, key=lambda row: (row[1], row[0]))
+        return cls(_columns_from_rows(rows, len(rows)), cursor)
+
+    @classmethod
+    def build(cls):
+        # Take the cursor first: events committed while we read the table are
+        # applied again on the next refresh, and applying a loan twice is harmless
+        cursor = ChangeEvent.objects.filter(table="loan").order_by("-id").values_list("id", flat=True).first() or 0
+        size = Loan.objects.count()
+        rows = Loan.objects.order_by("customer_id", "loan_id").values_list(*COLUMNS).iterator(chunk_size=10000)
+        return cls(_columns_from_rows(rows, size), cursor)
+
+    def with_events(self, events):
+        """Return a snapshot with the given (id, payload) loan events applied.
+
+        The current snapshot is left untouched so readers holding it keep a
+        consistent view.
+        """
+        if not events:
+            return self
+
+        # Last event per loan wins
+        latest = {}
+        for _, payload in events:
+            latest[payload["loan_id"]] = payload
+        new = _columns_from_rows(
+            (tuple(payload[name] for name in COLUMNS) for payload in latest.values()), len(latest))
+
+        # Older delta versions of these loans are dropped, the new ones appended
+        keep = ~np.isin(self.delta["loan_id"], new["loan_id"])
+        delta = {name: np.concatenate((self.delta[name][keep], new[name])) for name in COLUMNS}
+
+        # Base rows of these loans are marked dead
+        found = np.searchsorted(self._loan_ids, new["loan_id"])
+        found = found[found < len(self._loan_ids)]
+        found = found[np.isin(self._loan_ids[found], new["loan_id"])]
+        dead = np.union1d(self.dead, self._by_loan_id[found])
+        return self._derive(events[-1][0], delta, dead)
+
+    def refreshed(self, limit):
+        """Return (snapshot, caught_up) after applying at most limit new loan events."""
+        events = list(ChangeEvent.objects.filter(table="loan", id__gt=self.cursor)
+                      .order_by("id").values_list("id", "payload")[:limit])
+        return self.with_events(events), len(events) < limit
+
+    def compacted(self):
+        """Return an equivalent snapshot with the delta folded into a new base."""
+        if not self.delta_size:
+            return self
+        live = self._live()
+        merged = {name: np.concatenate((self.columns[name][live], self.delta[name])) for name in COLUMNS}
+        order = np.argsort(merged["customer_id"], kind="stable")
+        return LoanSnapshot({name: column[order] for name, column in merged.items()}, self.cursor)
+
+    @property
+    def delta_size(self):
+        return len(self.delta["loan_id"])
+
+    def _live(self):
+        live = np.ones(len(self.columns["loan_id"]), dtype=bool)
+        live[self.dead] = False
+        return live
+
+    def customer_slice(self, customer_id):
+        # The customer's rows in the base, dead ones included
+        position = np.searchsorted(self.customers, customer_id)
+        if position < len(self.customers) and self.customers[position] == customer_id:
+            return slice(self.offsets[position], self.offsets[position + 1])
+        return slice(0, 0)
+
+    def customer_loans(self, customer_id):
+        """Columns of the customer's current loans, base and delta combined."""
+        rows = self.customer_slice(customer_id)
+        positions = np.arange(rows.start, rows.stop)
+        positions = positions[~np.isin(positions, self.dead[
+            np.searchsorted(self.dead, rows.start):np.searchsorted(self.dead, rows.stop)])]
+        changed = self.delta["customer_id"] == customer_id
+        return {name: np.concatenate((self.columns[name][positions], self.delta[name][changed]))
+                for name in COLUMNS}
+
+    def customer_aggregates(self, customer_id, year=None):
+        year = year or date.today().year
+        loans = self.customer_loans(customer_id)
+        return {
+            "no_of_loans_taken": int(len(loans["loan_id"])),
+            "past_loans_paid_on_time": int(loans["emis_paid_on_time"].sum()),
+            "loan_activity_current_year": int((_approval_years(loans["date_of_approval"]) == year).sum()),
+            "loan_approved_volume": float(loans["loan_amount"].sum()),
+            "total_monthly_payment": float(loans["monthly_payment"].sum()),
+        }
+
+    def portfolio_summary(self, today=None):
+        today = np.datetime64(today or date.today(), "D")
+        live = self._live()
+        columns = {name: np.concatenate((self.columns[name][live], self.delta[name]))
+                   for name in ("loan_amount", "interest_rate", "monthly_payment", "date_of_approval", "end_date")}
+        amounts = columns["loan_amount"]
+        active = columns["end_date"] >= today
+        years, approvals = np.unique(_approval_years(columns["date_of_approval"]), return_counts=True)
+
+        # Per-customer exposure: base sums by offset, then the delta added in
+        if len(self.customers):
+            starts = self.offsets[:-1]
+            base_amounts = np.add.reduceat(np.where(live, self.columns["loan_amount"], 0.0), starts)
+            base_counts = np.add.reduceat(live.astype(np.int64), starts)
+        else:
+            base_amounts = np.empty(0)
+            base_counts = np.empty(0, dtype=np.int64)
+        customer_ids, owner = np.unique(
+            np.concatenate((self.customers, self.delta["customer_id"])), return_inverse=True)
+        per_customer = np.bincount(owner, np.concatenate((base_amounts, self.delta["loan_amount"])),
+                                   minlength=len(customer_ids))
+        loan_counts = np.bincount(owner, np.concatenate((base_counts, np.ones(self.delta_size))),
+                                  minlength=len(customer_ids))
+
+        total = float(amounts.sum())
+        return {
+            "loans": int(len(amounts)),
+            "customers": int((loan_counts > 0).sum()),
+            "total_loan_amount": round(total, 2),
+            "total_monthly_payment": round(float(columns["monthly_payment"].sum()), 2),
+            "weighted_interest_rate": round(float((columns["interest_rate"] * amounts).sum() / total), 4) if total else 0.0,
+            "active_loans": int(active.sum()),
+            "active_loan_amount": round(float(amounts[active].sum()), 2),
+            "max_customer_exposure": round(float(per_customer.max()), 2) if len(per_customer) else 0.0,
+            "approvals_per_year": {int(y): int(n) for y, n in zip(years, approvals)},
+            "snapshot_bytes": self.nbytes,
+            "delta_loans": self.delta_size,
+            "cursor": self.cursor,
+        }
+
+    @property
+    def nbytes(self):
+        return int(sum(column.nbytes for column in self.columns.values())
+                   + sum(column.nbytes for column in self.delta.values())
+                   + self.customers.nbytes + self.offsets.nbytes + self._by_loan_id.nbytes + self._loan_ids.nbytes + self.dead.nbytes)
+
+
+_snapshot = None
+_seen_local_writes = -1
+_lock = threading.Lock()
+_maintainer = None
+_stop = threading.Event()
+_wake = threading.Event()
+
+
+def _max_delta():
+    return getattr(settings, "LOAN_SNAPSHOT_MAX_DELTA", 10000)
+
+
+def _swap(candidate):
+    # Install a snapshot built without the lock, catching up on the events
+    # readers have already seen (so nothing they saw disappears) plus one
+    # more page. Returns whether the feed is fully applied.
+    global _snapshot
+    with _lock:
+        while True:
+            candidate, caught_up = candidate.refreshed(_max_delta())
+            if caught_up or candidate.cursor >= _snapshot.cursor:
+                break
+        _snapshot = candidate
+        return caught_up
+
+
+def _maintain():
+    refresh_interval = getattr(settings, "LOAN_SNAPSHOT_REFRESH_INTERVAL", 15.0)
+    rebuild_interval = getattr(settings, "LOAN_SNAPSHOT_REBUILD_INTERVAL", 300.0)
+    built_at = time.monotonic()
+    # The thread keeps its database connection between ticks and only drops
+    # it after an error, so an idle worker doesn't reconnect on every poll
+    while True:
+        _wake.wait(refresh_interval)
+        _wake.clear()
+        if _stop.is_set():
+            break
+        try:
+            if time.monotonic() - built_at >= rebuild_interval:
+                caught_up = _swap(LoanSnapshot.build())
+                built_at = time.monotonic()
+            elif _snapshot.delta_size > _max_delta():
+                caught_up = _swap(_snapshot.compacted())
+            else:
+                caught_up = _swap(_snapshot)
+            if not caught_up:
+                # A bulk write is being applied a page at a time; go again
+                _wake.set()
+        except Exception:
+            logger.exception("Loan snapshot maintenance failed")
+            connection.close()
+    connection.close()
+
+
+def get_snapshot():
+    """Return the process-wide snapshot, building it on first use."""
+    global _snapshot, _seen_local_writes, _maintainer
+    local_writes = changes.local_loan_writes
+    if _snapshot is not None and _seen_local_writes == local_writes:
+        return _snapshot
+
+    with _lock:
+        if _snapshot is None:
+            _snapshot = LoanSnapshot.build()
+        elif _seen_local_writes != local_writes:
+            # Show this process's own loan writes straight away, up to
+            # LOAN_SNAPSHOT_INLINE_EVENTS of them; after a bulk upload the
+            # rest is left to the maintenance thread
+            _snapshot, caught_up = _snapshot.refreshed(getattr(settings, "LOAN_SNAPSHOT_INLINE_EVENTS", 1000))
+            if not caught_up:
+                _wake.set()
+        _seen_local_writes = local_writes
+        if _maintainer is None:
+            _stop.clear()
+            _wake.clear()
+            _maintainer = threading.Thread(target=_maintain, name="loan-snapshot", daemon=True)
+            _maintainer.start()
+        return _snapshot
+
+
+def reset_snapshot():
+    global _snapshot, _maintainer
+    _stop.set()
+    _wake.set()
+    if _maintainer is not None:
+        _maintainer.join()
+    with _lock:
+        _snapshot = None
+        _maintainer = None
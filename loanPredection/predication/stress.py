@@ -0,0 +1,61 @@
+# Monte Carlo stress test over the loan book.
+#
+# The simulation itself lives in stress_engine.py, which pool workers can
+# import without Django; this module adds loading the book from the database.
+
+from datetime import date
+
+import numpy as np
+
+from .models import Loan, Customer
+
+
+def _months_between(start, end):
+    return (end.year - start.year) * 12 + (end.month - start.month)
+
+
+# Function to pull Loan / Customer into column arrays
+def load_book(today=None):
+    today = today or date.today()
+    count = Loan.objects.count()
+
+    customer_id = np.empty(count, dtype=np.int64)
+    amount = np.empty(count, dtype=np.float64)
+    rate = np.empty(count, dtype=np.float64)
+    tenure = np.empty(count, dtype=np.int32)
+    monthly_payment = np.empty(count, dtype=np.float64)
+    emis_paid_on_time = np.empty(count, dtype=np.int32)
+    months_elapsed = np.empty(count, dtype=np.int32)
+
+    rows = Loan.objects.values_list(
+        "customer_id", "loan_amount", "interest_rate", "tenure",
+        "monthly_payment", "emis_paid_on_time", "date_of_approval",
+    ).order_by().iterator(chunk_size=10000)
+    i = -1
+    for i, row in enumerate(rows):
+        if i >= count:
+            break  # rows inserted after the count; they belong to the next run
+        customer_id[i] = row[0]
+        amount[i] = row[1]
+        rate[i] = row[2]
+        tenure[i] = row[3]
+        monthly_payment[i] = row[4]
+        emis_paid_on_time[i] = row[5]
+        months_elapsed[i] = _months_between(row[6], today)
+    loaded = min(i + 1, count)
+
+    customers = Customer.objects.values_list("customer_id", "monthly_salary").order_by("customer_id")
+    salary_ids = np.fromiter((c[0] for c in customers), dtype=np.int64)
+    salaries = np.array([float(c[1]) for c in customers], dtype=np.float64)
+
+    return {
+        "customer_id": customer_id[:loaded],
+        "loan_amount": amount[:loaded],
+        "interest_rate": rate[:loaded],
+        "tenure": tenure[:loaded],
+        "monthly_payment": monthly_payment[:loaded],
+        "emis_paid_on_time": emis_paid_on_time[:loaded],
+        "months_elapsed": months_elapsed[:loaded],
+        "salary_customer_id": salary_ids,
+        "monthly_salary": salaries,
+    }
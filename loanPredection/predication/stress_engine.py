@@ -0,0 +1,186 @@
+# Monte Carlo stress test over the loan book: the simulation engine.
+#
+# The book comes in column-wise as NumPy arrays (one value per loan), each
+# loan gets a one-year default probability and prepayment rate under the
+# requested shocks, and every path draws a shared economy-wide factor plus
+# per-loan noise. The book is split into chunks that are simulated in a
+# process pool; each chunk returns its loss per path and the totals are
+# summed across chunks.
+#
+# This module imports nothing but NumPy. Pool workers started with "spawn"
+# or "forkserver" (the default on Windows and macOS, and on Linux from
+# Python 3.14) import it without Django being set up, so it must not pull in
+# models; loading the book from the database lives in stress.py.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+DEFAULT_SCENARIO = {
+    "paths": 1000,
+    "rate_shock_bps": 0,          # parallel shift of interest rates
+    "default_multiplier": 1.0,    # straight multiplier on every PD
+    "base_pd": 0.02,              # annual PD of a loan with a clean record
+    "base_prepay": 0.05,          # annual prepayment rate with no rate shock
+    "lgd": 0.45,                  # loss given default, share of the balance
+    "systemic_volatility": 0.5,   # spread of the economy-wide PD multiplier
+    "seed": None,
+}
+
+PERCENTILES = [50, 90, 95, 99, 99.9]
+
+# Upper bound on loans x paths held in memory at once by one worker
+BLOCK_CELLS = 4_000_000
+
+
+# Function to build a random book with the same columns, for benchmarking
+def synthetic_book(size, customers=None, seed=0):
+    rng = np.random.default_rng(seed)
+    customers = customers or max(size // 3, 1)
+    tenure = rng.integers(1, 21, size, dtype=np.int32)
+    amount = rng.uniform(50_000, 1_000_000, size).round(2)
+    rate = rng.uniform(8, 18, size)
+    monthly_rate = rate / 1200
+    payments = tenure * 12
+    monthly_payment = amount * monthly_rate / (1 - (1 + monthly_rate) ** -payments)
+    months_elapsed = (rng.random(size) * payments).astype(np.int32)
+    emis_paid_on_time = (months_elapsed * rng.beta(8, 1, size)).astype(np.int32)
+    return {
+        "customer_id": rng.integers(1, customers + 1, size, dtype=np.int64),
+        "loan_amount": amount,
+        "interest_rate": rate,
+        "tenure": tenure,
+        "monthly_payment": monthly_payment,
+        "emis_paid_on_time": emis_paid_on_time,
+        "months_elapsed": months_elapsed,
+        "salary_customer_id": np.arange(1, customers + 1, dtype=np.int64),
+        "monthly_salary": rng.uniform(20_000, 300_000, customers).round(2),
+    }
+
+
+def _outstanding_balance(book):
+    principal = book["loan_amount"]
+    payments = book["tenure"].astype(np.float64) * 12
+    elapsed = np.minimum(book["months_elapsed"], payments)
+    monthly_rate = book["interest_rate"] / 1200
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth_total = (1 + monthly_rate) ** payments
+        growth_paid = (1 + monthly_rate) ** elapsed
+        amortising = principal * (growth_total - growth_paid) / (growth_total - 1)
+    straight_line = principal * (1 - elapsed / np.maximum(payments, 1))
+    balance = np.where(monthly_rate > 0, amortising, straight_line)
+    return np.clip(np.nan_to_num(balance), 0, None)
+
+
+def _debt_to_income(book):
+    # Total monthly EMI per customer divided by the customer's salary
+    ids, inverse = np.unique(book["customer_id"], return_inverse=True)
+    emi_per_customer = np.bincount(inverse, weights=book["monthly_payment"])
+    salary_ids = book["salary_customer_id"]
+    salaries = book["monthly_salary"]
+    position = np.clip(np.searchsorted(salary_ids, ids), 0, max(len(salary_ids) - 1, 0))
+    if len(salary_ids):
+        found = (salary_ids[position] == ids) & (salaries[position] > 0)
+        salary = np.where(found, salaries[position], np.nan)
+    else:
+        salary = np.full(len(ids), np.nan)
+    dti = np.nan_to_num(emi_per_customer / salary, nan=0.0)
+    return dti[inverse]
+
+
+# Function to turn the book and scenario into per-loan inputs for the simulation
+def prepare_exposures(book, scenario):
+    active = book["months_elapsed"] < book["tenure"] * 12
+    ead = _outstanding_balance(book)[active]
+
+    elapsed = np.maximum(book["months_elapsed"][active], 1)
+    on_time_ratio = np.clip(book["emis_paid_on_time"][active] / elapsed, 0, 1)
+    dti = _debt_to_income(book)[active]
+
+    shock = scenario["rate_shock_bps"] / 100
+    pd = (
+        scenario["base_pd"]
+        * (1 + 3 * (1 - on_time_ratio))              # missed EMIs
+        * (1 + 2 * np.clip(dti - 0.5, 0, None))      # stretched customers
+        * np.exp(0.15 * shock)                       # higher rates, more defaults
+        * scenario["default_multiplier"]
+    )
+    prepay = np.full(len(ead), scenario["base_prepay"] * np.exp(-0.3 * shock))
+
+    return {
+        "loss_given_default": ead * scenario["lgd"],
+        "pd": np.clip(pd, 0, 1).astype(np.float32),
+        "prepay": np.clip(prepay, 0, 1).astype(np.float32),
+        "exposure": float(ead.sum()),
+        "loans": int(active.sum()),
+    }
+
+
+def _simulate_chunk(args):
+    loss_given_default, pd, prepay, systemic, seed = args
+    rng = np.random.default_rng(seed)
+    paths = len(systemic)
+    losses = np.zeros(paths, dtype=np.float64)
+    block = max(1, BLOCK_CELLS // paths)
+
+    for start in range(0, len(pd), block):
+        stop = start + block
+        # One uniform per loan and path: below prepay the loan is repaid early,
+        # the next (1 - prepay) * pd slice of the interval is a default.
+        path_pd = np.minimum(pd[start:stop, None] * systemic[None, :], 1)
+        lower = prepay[start:stop, None]
+        upper = lower + (1 - lower) * path_pd
+        draws = rng.random(path_pd.shape, dtype=np.float32)
+        defaulted = (draws >= lower) & (draws < upper)
+        losses += loss_given_default[start:stop] @ defaulted
+    return losses
+
+
+# Function to run the stress test and summarise the loss distribution
+def run_stress_test(book, scenario=None, workers=None, chunk_size=100_000, mp_context=None):
+    scenario = {**DEFAULT_SCENARIO, **(scenario or {})}
+    paths = int(scenario["paths"])
+    exposures = prepare_exposures(book, scenario)
+
+    seeds = np.random.SeedSequence(scenario["seed"])
+    systemic_seed, chunk_seed = seeds.spawn(2)
+    sigma = scenario["systemic_volatility"]
+    z = np.random.default_rng(systemic_seed).standard_normal(paths)
+    systemic = np.exp(sigma * z - sigma ** 2 / 2).astype(np.float32)
+
+    total = len(exposures["pd"])
+    bounds = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    chunk_seeds = chunk_seed.spawn(len(bounds))
+    tasks = [
+        (exposures["loss_given_default"][a:b], exposures["pd"][a:b],
+         exposures["prepay"][a:b], systemic, s)
+        for (a, b), s in zip(bounds, chunk_seeds)
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    losses = np.zeros(paths, dtype=np.float64)
+    if workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            losses += _simulate_chunk(task)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=mp_context) as pool:
+            for chunk_losses in pool.map(_simulate_chunk, tasks):
+                losses += chunk_losses
+
+    exposure = exposures["exposure"]
+    expected_loss = float(losses.mean()) if paths else 0.0
+    return {
+        "loans": exposures["loans"],
+        "paths": paths,
+        "exposure_at_default": round(exposure, 2),
+        "expected_loss": round(expected_loss, 2),
+        "expected_loss_rate": round(expected_loss / exposure, 6) if exposure else 0.0,
+        "loss_std": round(float(losses.std()), 2) if paths else 0.0,
+        "loss_percentiles": {
+            str(p): round(float(v), 2)
+            for p, v in zip(PERCENTILES, np.percentile(losses, PERCENTILES) if paths else [0.0] * len(PERCENTILES))
+        },
+        "scenario": {k: v for k, v in scenario.items() if k != "paths"},
+    }
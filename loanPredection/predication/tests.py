@@ -1,3 +1,722 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from .changes import loan_change, record_changes
+from .idempotency import clear_cache, idempotent
+from .models import Loan, Customer, ChangeEvent, IdempotencyKey
+
+
+class StartupImportTests(SimpleTestCase):
+    def test_request_path_does_not_import_parsing_stack(self):
+        out = StringIO()
+        call_command('profile_startup', 'loanPredection.urls', 'predication.urls', 'predication.views',
+                     '--json', stdout=out)
+        for result in json.loads(out.getvalue()):
+            self.assertFalse(result['loads_pandas'], f"{result['module']} imports pandas")
+            self.assertFalse(result['loads_openpyxl'], f"{result['module']} imports openpyxl")
+
+
+class CustomerSummaryTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            first_name="Asha", last_name="Rao", age=34, phone_number="9000000001",
+            monthly_salary=100000, approved_limit=3600000,
+        )
+        today = date.today()
+        for loan_id, tenure, approved in [(1001, 5, today), (1002, 2, date(today.year - 4, 1, 1)), (1003, 3, today)]:
+            Loan.objects.create(
+                customer_id=self.customer.customer_id, loan_id=loan_id, loan_amount=200000,
+                tenure=tenure, interest_rate=12.0, monthly_payment=5000, emis_paid_on_time=10,
+                date_of_approval=approved, end_date=date(approved.year + tenure, approved.month, 1),
+            )
+
+    def test_summary_uses_at_most_two_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/customers/{self.customer.customer_id}/summary/")
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(data["customer_id"], self.customer.customer_id)
+        active = {loan["loan_id"]: loan for loan in data["active_loans"]}
+        self.assertEqual(sorted(active), [1001, 1003])
+        self.assertEqual(active[1001]["repayments_left"], 60)
+        self.assertEqual(data["credit_score"]["no_of_loans_taken"], 3)
+        self.assertEqual(data["credit_score"]["past_loans_paid_on_time"], 30)
+        self.assertEqual(data["credit_score"]["loan_activity_current_year"], 2)
+        self.assertAlmostEqual(data["credit_score"]["score"], 30 * 0.4 + 3 * 0.3 + 2 * 0.2 + 600000 * 0.1)
+        self.assertEqual(data["headroom"]["remaining_limit"], 3000000)
+        self.assertEqual(data["headroom"]["active_loan_amount"], 400000)
+        self.assertEqual(data["headroom"]["remaining_monthly_installment"], 40000)
+
+    def test_remaining_limit_matches_eligibility(self):
+        # A closed loan still counts against the limit, as it does in eligibility
+        customer = Customer.objects.create(
+            first_name="Meera", last_name="Iyer", age=40, phone_number="9000000002",
+            monthly_salary=100000, approved_limit=300000,
+        )
+        for loan_id, amount, approved, end in [(2001, 200000, date(2015, 1, 1), date(2017, 1, 1)),
+                                               (2002, 150000, date.today(), date(date.today().year + 2, 1, 1))]:
+            Loan.objects.create(
+                customer_id=customer.customer_id, loan_id=loan_id, loan_amount=amount, tenure=2,
+                interest_rate=12.0, monthly_payment=5000, emis_paid_on_time=24,
+                date_of_approval=approved, end_date=end,
+            )
+
+        data = self.client.get(f"/api/customers/{customer.customer_id}/summary/").json()
+        self.assertEqual([loan["loan_id"] for loan in data["active_loans"]], [2002])
+        self.assertEqual(data["headroom"]["total_loan_amount"], 350000)
+        self.assertEqual(data["headroom"]["remaining_limit"], -50000)
+        self.assertEqual(data["headroom"]["active_loan_amount"], 150000)
+        self.assertEqual(data["credit_score"]["score"], 0)
+
+        eligibility = self.client.post("/api/loan_eligibility/", json.dumps({
+            "customer_id": customer.customer_id, "loan_amount": 10000, "interest_rate": 10, "tenure": 1,
+        }), content_type="application/json").json()
+        self.assertFalse(eligibility["approval"])
+
+    def test_unknown_customer(self):
+        response = self.client.get("/api/customers/999999/summary/")
+        self.assertEqual(response.status_code, 404)
+
+
+def _workbook(name, headers, rows):
+    import openpyxl
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet.append(headers)
+    for row in rows:
+        sheet.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+LOAN_HEADERS = ["Customer ID", "Loan ID", "Loan Amount", "Tenure", "Interest Rate",
+                "Monthly payment", "EMIs paid on Time", "Date of Approval", "End Date"]
+CUSTOMER_HEADERS = ["Customer ID", "First Name", "Last Name", "Age",
+                    "Phone Number", "Monthly Salary", "Approved Limit"]
+
+
+class ChangeFeedTests(TestCase):
+    def _events(self, **params):
+        return self.client.get("/api/changes/", params).json()
+
+    def test_add_customer_records_event(self):
+        response = self.client.post("/api/add_customer/", json.dumps({
+            "first_name": "Ravi", "last_name": "Kumar", "age": 30,
+            "monthly_income": 80000, "phone_number": "9000000100",
+        }), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+
+        [event] = self._events()["events"]
+        self.assertEqual((event["table"], event["operation"]), ("customer", "create"))
+        self.assertEqual(event["object_id"], response.json()["customer_id"])
+        self.assertEqual(event["payload"]["approved_limit"], 2900000.0)
+
+    def test_create_new_loan_records_event(self):
+        customer = Customer.objects.create(first_name="Meera", last_name="Shah", age=40, phone_number="9000000101",
+                                           monthly_salary=200000, approved_limit=7200000)
+        Loan.objects.create(customer_id=customer.customer_id, loan_id=700, loan_amount=100000, tenure=1,
+                            interest_rate=10, monthly_payment=9000, emis_paid_on_time=200,
+                            date_of_approval=date(2020, 1, 1), end_date=date(2021, 1, 1))
+        response = self.client.post("/api/create_new_loan/", json.dumps({
+            "customer_id": customer.customer_id, "loan_amount": 100000, "interest_rate": 10, "tenure": 2,
+        }), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+
+        [event] = self._events(table="loan")["events"]
+        self.assertEqual(event["object_id"], response.json()["loan_id"])
+        self.assertEqual(event["payload"]["customer_id"], customer.customer_id)
+        self.assertEqual(event["payload"]["date_of_approval"], date.today().isoformat())
+
+    def test_upload_loan_data_records_created_loans_only(self):
+        rows = [[1, 501, 100000, 12, 10.5, 9000, 5, datetime(2020, 1, 1), datetime(2021, 1, 1)],
+                [2, 502, 200000, 24, 11.0, 9500, 8, datetime(2021, 6, 1), datetime(2023, 6, 1)]]
+        response = self.client.post("/api/upload_loan_data/", {"file": _workbook("loans.xlsx", LOAN_HEADERS, rows)})
+        self.assertEqual(response.status_code, 201)
+        self.client.post("/api/upload_loan_data/", {"file": _workbook("loans.xlsx", LOAN_HEADERS, rows)})
+
+        events = self._events()["events"]
+        self.assertEqual([e["object_id"] for e in events], [501, 502])
+        self.assertEqual(events[0]["payload"]["date_of_approval"], "2020-01-01")
+
+    def test_upload_loan_data_keeps_rows_before_a_bad_row(self):
+        rows = [[1, 601, 100000, 12, 10.5, 9000, 5, datetime(2020, 1, 1), datetime(2021, 1, 1)],
+                [2, 602, "not a number", 24, 11.0, 9500, 8, datetime(2021, 6, 1), datetime(2023, 6, 1)],
+                [3, 603, 300000, 24, 11.0, 9500, 8, datetime(2021, 6, 1), datetime(2023, 6, 1)]]
+        response = self.client.post("/api/upload_loan_data/", {"file": _workbook("loans.xlsx", LOAN_HEADERS, rows)})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(Loan.objects.values_list("loan_id", flat=True)), [601])
+        self.assertEqual([e["object_id"] for e in self._events()["events"]], [601])
+
+    def test_upload_commits_in_batches(self):
+        rows = [[1, loan_id, 100000, 12, 10.5, 9000, 5, datetime(2020, 1, 1), datetime(2021, 1, 1)]
+                for loan_id in (701, 702, 703, 704, 705)]
+        rows[3][2] = "not a number"
+        with mock.patch("predication.ingestion.INGEST_BATCH_SIZE", 2), \
+                mock.patch("predication.ingestion.record_changes", wraps=record_changes) as recorded:
+            response = self.client.post("/api/upload_loan_data/", {"file": _workbook("loans.xlsx", LOAN_HEADERS, rows)})
+        self.assertEqual(response.status_code, 400)
+        # One set of events per batch; the batch with the bad row keeps the rows ahead of it
+        self.assertEqual([[e.object_id for e in c.args[0]] for c in recorded.call_args_list], [[701, 702], [703]])
+        self.assertEqual(sorted(Loan.objects.values_list("loan_id", flat=True)), [701, 702, 703])
+
+    def test_upload_customer_data_records_creates_and_updates(self):
+        rows = [[1, "Anil", "Das", 45, "9000000201", 50000, 1800000]]
+        self.client.post("/api/upload_customer_data/", {"excel_file": _workbook("c.xlsx", CUSTOMER_HEADERS, rows)})
+        rows[0][5] = 60000
+        self.client.post("/api/upload_customer_data/", {"excel_file": _workbook("c.xlsx", CUSTOMER_HEADERS, rows)})
+
+        events = self._events(table="customer")["events"]
+        self.assertEqual([e["operation"] for e in events], ["create", "update"])
+        self.assertEqual(events[1]["payload"]["monthly_salary"], 60000.0)
+
+    def test_pagination(self):
+        record_changes([ChangeEvent(table="loan" if i % 2 else "customer", operation="create",
+                                    object_id=i, payload={}) for i in range(5)])
+
+        page = self._events(limit=2)
+        self.assertEqual([e["object_id"] for e in page["events"]], [0, 1])
+        self.assertTrue(page["has_more"])
+        page = self._events(since=page["next_cursor"], limit=2)
+        self.assertEqual([e["object_id"] for e in page["events"]], [2, 3])
+        page = self._events(since=page["next_cursor"], limit=2)
+        self.assertEqual([e["object_id"] for e in page["events"]], [4])
+        self.assertFalse(page["has_more"])
+
+        # An empty page keeps the cursor where it was
+        last = self._events(since=page["next_cursor"])
+        self.assertEqual((last["events"], last["next_cursor"]), ([], page["next_cursor"]))
+
+    def test_table_filter_and_limit_clamping(self):
+        record_changes([ChangeEvent(table="loan" if i % 2 else "customer", operation="create",
+                                    object_id=i, payload={}) for i in range(6)])
+
+        self.assertEqual([e["object_id"] for e in self._events(table="loan")["events"]], [1, 3, 5])
+        self.assertEqual(len(self._events(limit=0)["events"]), 1)
+        with self.settings(CHANGE_FEED_MAX_PAGE_SIZE=4):
+            page = self._events(limit=100)
+        self.assertEqual(len(page["events"]), 4)
+        self.assertTrue(page["has_more"])
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get("/api/changes/", {"since": "abc"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/changes/", {"limit": "x"}).status_code, 400)
+
+
+class StressTestTests(SimpleTestCase):
+    def setUp(self):
+        from .stress_engine import synthetic_book
+        self.book = synthetic_book(3000, seed=7)
+
+    def run_test(self, **kwargs):
+        from .stress_engine import run_stress_test
+        scenario = {"paths": 200, "seed": 11, **kwargs.pop("scenario", {})}
+        return run_stress_test(self.book, scenario, **{"workers": 1, "chunk_size": 1000, **kwargs})
+
+    def test_fixed_seed_is_deterministic(self):
+        first = self.run_test()
+        self.assertEqual(first, self.run_test())
+        self.assertEqual(first["paths"], 200)
+        self.assertGreater(first["expected_loss"], 0)
+        self.assertLessEqual(first["loss_percentiles"]["50"], first["loss_percentiles"]["99"])
+
+    def test_process_pool_matches_single_process(self):
+        self.assertEqual(self.run_test(workers=1), self.run_test(workers=2))
+
+    def test_process_pool_under_spawn(self):
+        # Workers started with "spawn" import the engine without Django set up
+        from multiprocessing import get_context
+        self.assertEqual(self.run_test(workers=1), self.run_test(workers=2, mp_context=get_context("spawn")))
+
+    def test_no_loss_when_nothing_is_lost_on_default(self):
+        result = self.run_test(scenario={"lgd": 0})
+        self.assertEqual(result["expected_loss"], 0)
+        self.assertEqual(set(result["loss_percentiles"].values()), {0})
+
+    def test_shocks_raise_expected_loss(self):
+        base = self.run_test()["expected_loss"]
+        self.assertGreater(self.run_test(scenario={"rate_shock_bps": 300, "default_multiplier": 2})["expected_loss"], base)
+
+
+class StressTestViewTests(TestCase):
+    def test_rejects_out_of_range_parameters(self):
+        for params in ({"lgd": "1.5"}, {"lgd": "-0.1"}, {"default_multiplier": "-1"}, {"paths": "0"}, {"lgd": "x"}):
+            self.assertEqual(self.client.get("/api/stress_test/", params).status_code, 400, params)
+
+    def test_runs_on_empty_book(self):
+        response = self.client.get("/api/stress_test/", {"paths": 10, "seed": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["expected_loss"], 0)
+
+
+class RouteGateTests(SimpleTestCase):
+    def gate(self, **limits):
+        from .middleware import RouteGate
+        return RouteGate("test", **{"max_concurrent": 1, "max_queue": 1, "queue_timeout": 0.1,
+                                    "retry_after": 3, **limits})
+
+    def test_admits_up_to_max_concurrent(self):
+        gate = self.gate(max_concurrent=2)
+        self.assertIsNone(gate.acquire())
+        self.assertIsNone(gate.acquire())
+        self.assertEqual(gate.stats()["active"], 2)
+        gate.release()
+        gate.release()
+        self.assertEqual(gate.stats()["active"], 0)
+        self.assertEqual(gate.stats()["admitted"], 2)
+
+    def test_rejects_with_429_when_queue_is_full(self):
+        gate = self.gate(max_queue=0)
+        gate.acquire()
+        self.assertEqual(gate.acquire(), 429)
+        self.assertEqual(gate.stats()["rejected_queue_full"], 1)
+
+    def test_rejects_with_503_after_queue_timeout(self):
+        gate = self.gate()
+        gate.acquire()
+        self.assertEqual(gate.acquire(), 503)
+        stats = gate.stats()
+        self.assertEqual((stats["rejected_timeout"], stats["queued"], stats["max_queued"]), (1, 0, 1))
+
+    def test_queued_request_gets_released_slot(self):
+        gate = self.gate(queue_timeout=5)
+        gate.acquire()
+        threading.Timer(0.05, gate.release).start()
+        self.assertIsNone(gate.acquire())
+        self.assertEqual(gate.stats()["admitted"], 2)
+
+    def test_shared_waiting_cap(self):
+        waiting_slots = threading.BoundedSemaphore(1)
+        first = self.gate(max_queue=5, queue_timeout=5, waiting_slots=waiting_slots)
+        second = self.gate(max_queue=5, waiting_slots=waiting_slots)
+        first.acquire()
+        second.acquire()
+        waiter = threading.Thread(target=first.acquire)
+        waiter.start()
+        while first.stats()["queued"] == 0:
+            time.sleep(0.01)
+        # The only waiting slot is taken by the other route's queue
+        self.assertEqual(second.acquire(), 429)
+        first.release()
+        waiter.join()
+
+
+class AdmissionControlMiddlewareTests(TestCase):
+    def test_rejected_request_carries_retry_after(self):
+        from . import middleware
+        from .middleware import RouteGate
+
+        gates = middleware.get_gates()
+        original = gates.get("upload_loan_data")
+        self.addCleanup(gates.__setitem__, "upload_loan_data", original)
+        gate = gates["upload_loan_data"] = RouteGate("upload_loan_data", max_concurrent=1, max_queue=0,
+                                                     queue_timeout=0, retry_after=7)
+        gate.acquire()
+
+        response = self.client.post("/api/upload_loan_data/")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertEqual(self.client.get("/api/admission_stats/").json()["upload_loan_data"]["rejected_queue_full"], 1)
+
+        # Routes without a gate are not affected
+        self.assertEqual(self.client.get("/api/view_loan/loanid/1/").status_code, 404)
+        gate.release()
+        self.assertEqual(self.client.post("/api/upload_loan_data/").status_code, 400)
+
+
+CUSTOMER_BODY = {"first_name": "Ravi", "last_name": "Kumar", "age": 30,
+                 "monthly_income": 50000, "phone_number": "9000000009"}
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        clear_cache()
+        self.factory = RequestFactory()
+
+    def post(self, body, key="key-1"):
+        return self.client.post("/api/add_customer/", json.dumps(body),
+                                content_type="application/json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replays_first_response(self):
+        first = self.post(CUSTOMER_BODY)
+        self.assertEqual(first.status_code, 201)
+
+        second = self.post(CUSTOMER_BODY)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(second.json(), first.json())
+
+        # Replayed from the stored row once the cache is gone
+        clear_cache()
+        third = self.post(CUSTOMER_BODY)
+        self.assertEqual(third["Idempotent-Replayed"], "true")
+        self.assertEqual(third.json(), first.json())
+        self.assertEqual(Customer.objects.count(), 1)
+
+    def test_different_body_is_rejected(self):
+        self.post(CUSTOMER_BODY)
+        response = self.post({**CUSTOMER_BODY, "age": 31})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Customer.objects.count(), 1)
+
+    def test_server_error_is_not_stored(self):
+        calls = []
+
+        @idempotent
+        def flaky(request):
+            calls.append(1)
+            Customer.objects.create(first_name="Ravi", last_name="Kumar", age=30, phone_number="9000000009",
+                                    monthly_salary=50000, approved_limit=1800000)
+            if len(calls) == 1:
+                return JsonResponse({"error": "boom"}, status=500)
+            return JsonResponse({"ok": True}, status=201)
+
+        request = lambda: self.factory.post("/", b"{}", content_type="application/json",
+                                            HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(flaky(request()).status_code, 500)
+        # The view's write was rolled back together with the key
+        self.assertEqual(Customer.objects.count(), 0)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = flaky(request())
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, 201)
+
+
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        clear_cache()
+        self.factory = RequestFactory()
+
+    def request(self):
+        return self.factory.post("/", b"{}", content_type="application/json", HTTP_IDEMPOTENCY_KEY="key-1")
+
+    def test_concurrent_duplicates_run_the_view_once(self):
+        calls = []
+        release = threading.Event()
+
+        @idempotent
+        def slow(request):
+            calls.append(1)
+            release.wait(5)
+            return JsonResponse({"call": len(calls)}, status=201)
+
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(slow(self.request()))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.status_code for r in responses], [201] * 5)
+        self.assertEqual({r.content for r in responses}, {b'{"call": 1}'})
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.2)
+    def test_duplicate_gives_up_after_wait_timeout(self):
+        started, release = threading.Event(), threading.Event()
+
+        @idempotent
+        def blocked(request):
+            started.set()
+            release.wait(5)
+            return JsonResponse({"ok": True}, status=201)
+
+        first = threading.Thread(target=blocked, args=(self.request(),))
+        first.start()
+        started.wait(5)
+        try:
+            response = blocked(self.request())
+        finally:
+            release.set()
+            first.join()
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Retry-After"], "1")
+
+
+def _loan_row(loan_id, customer_id, amount, approved=date(2024, 1, 1), end=date(2030, 1, 1), paid=10):
+    # In snapshot.COLUMNS order
+    return (loan_id, customer_id, amount, 10.0, 5, amount / 50, paid, approved, end)
+
+
+def _loan_event(event_id, row):
+    from .snapshot import COLUMNS
+    payload = dict(zip(COLUMNS, row))
+    payload["date_of_approval"] = payload["date_of_approval"].isoformat()
+    payload["end_date"] = payload["end_date"].isoformat()
+    return (event_id, payload)
+
+
+class LoanSnapshotTests(SimpleTestCase):
+    def snapshot(self):
+        from .snapshot import LoanSnapshot
+        return LoanSnapshot.from_rows([
+            _loan_row(1, 10, 1000.0), _loan_row(2, 10, 2000.0), _loan_row(3, 20, 500.0, end=date(2020, 1, 1)),
+        ])
+
+    def test_update_replaces_existing_loan(self):
+        base = self.snapshot()
+        updated = base.with_events([_loan_event(5, _loan_row(2, 10, 3000.0, paid=12))])
+
+        self.assertEqual(updated.cursor, 5)
+        self.assertEqual(updated.customer_aggregates(10, year=2024), {
+            "no_of_loans_taken": 2,
+            "past_loans_paid_on_time": 22,
+            "loan_activity_current_year": 2,
+            "loan_approved_volume": 4000.0,
+            "total_monthly_payment": 80.0,
+        })
+        # The base is shared, not copied, and the old snapshot is unchanged
+        self.assertIs(updated.columns, base.columns)
+        self.assertEqual(base.customer_aggregates(10, year=2024)["loan_approved_volume"], 3000.0)
+
+        # A second update of the same loan replaces the delta row
+        again = updated.with_events([_loan_event(6, _loan_row(2, 10, 100.0))])
+        self.assertEqual(again.delta_size, 1)
+        self.assertEqual(again.customer_aggregates(10)["loan_approved_volume"], 1100.0)
+
+    def test_insert_for_new_customer(self):
+        snapshot = self.snapshot().with_events([
+            _loan_event(7, _loan_row(4, 30, 700.0)), _loan_event(8, _loan_row(5, 30, 300.0)),
+        ])
+        self.assertEqual(snapshot.customer_aggregates(30)["no_of_loans_taken"], 2)
+        self.assertEqual(snapshot.customer_aggregates(30)["loan_approved_volume"], 1000.0)
+        self.assertEqual(snapshot.customer_aggregates(10)["no_of_loans_taken"], 2)
+        self.assertEqual(snapshot.customer_aggregates(99)["no_of_loans_taken"], 0)
+
+    def test_empty_book(self):
+        from .snapshot import LoanSnapshot
+        empty = LoanSnapshot.from_rows([])
+        self.assertEqual(empty.customer_aggregates(1)["no_of_loans_taken"], 0)
+        summary = empty.portfolio_summary(today=date(2025, 1, 1))
+        self.assertEqual((summary["loans"], summary["customers"], summary["max_customer_exposure"]), (0, 0, 0.0))
+
+        snapshot = empty.with_events([_loan_event(1, _loan_row(1, 10, 1000.0))])
+        self.assertEqual(snapshot.portfolio_summary(today=date(2025, 1, 1))["total_loan_amount"], 1000.0)
+
+    def test_portfolio_summary(self):
+        snapshot = self.snapshot().with_events([
+            _loan_event(1, _loan_row(3, 20, 5000.0, approved=date(2023, 6, 1))),
+            _loan_event(2, _loan_row(4, 30, 700.0)),
+        ])
+        summary = snapshot.portfolio_summary(today=date(2025, 1, 1))
+        self.assertEqual(summary["loans"], 4)
+        self.assertEqual(summary["customers"], 3)
+        self.assertEqual(summary["total_loan_amount"], 8700.0)
+        self.assertEqual(summary["active_loans"], 4)
+        self.assertEqual(summary["max_customer_exposure"], 5000.0)
+        self.assertEqual(summary["approvals_per_year"], {2023: 1, 2024: 3})
+
+        # Folding the delta into the base gives the same answers
+        compacted = snapshot.compacted()
+        self.assertEqual(compacted.delta_size, 0)
+        self.assertEqual({**compacted.portfolio_summary(today=date(2025, 1, 1)), "snapshot_bytes": 0, "delta_loans": 0},
+                         {**summary, "snapshot_bytes": 0, "delta_loans": 0})
+        self.assertEqual(compacted.customer_aggregates(20), snapshot.customer_aggregates(20))
+
+
+class LoanEligibilityTests(TestCase):
+    def test_reads_latest_loans_from_database(self):
+        customer = Customer.objects.create(first_name="Asha", last_name="Rao", age=34, phone_number="9000000001",
+                                           monthly_salary=100000, approved_limit=3600000)
+        body = json.dumps({"customer_id": customer.customer_id, "loan_amount": 100000,
+                           "interest_rate": 10, "tenure": 2})
+        first = self.client.post("/api/loan_eligibility/", body, content_type="application/json").json()
+        self.assertFalse(first["approval"])
+
+        Loan.objects.create(customer_id=customer.customer_id, loan_id=1, loan_amount=100000, tenure=2,
+                            interest_rate=10, monthly_payment=4600, emis_paid_on_time=200,
+                            date_of_approval=date.today(), end_date=date.today())
+        second = self.client.post("/api/loan_eligibility/", body, content_type="application/json").json()
+        self.assertTrue(second["approval"])
+
+
+@override_settings(LOAN_SNAPSHOT_REFRESH_INTERVAL=60)
+class PortfolioSummaryViewTests(TestCase):
+    def setUp(self):
+        from .snapshot import reset_snapshot
+        self.addCleanup(reset_snapshot)
+
+    def test_shows_own_loan_writes(self):
+        self.assertEqual(self.client.get("/api/portfolio_summary/").json()["loans"], 0)
+
+        loan = Loan.objects.create(customer_id=1, loan_id=1, loan_amount=1000, tenure=1, interest_rate=10,
+                                   monthly_payment=90, emis_paid_on_time=0,
+                                   date_of_approval=date.today(), end_date=date.today())
+        with self.captureOnCommitCallbacks(execute=True):
+            record_changes([loan_change(loan)])
+        data = self.client.get("/api/portfolio_summary/").json()
+        self.assertEqual((data["loans"], data["delta_loans"], data["total_loan_amount"]), (1, 1, 1000.0))
+
+        customer = self.client.get("/api/portfolio_summary/", {"customer_id": 1}).json()
+        self.assertEqual((customer["no_of_loans_taken"], customer["loan_approved_volume"],
+                          customer["total_monthly_payment"]), (1, 1000.0, 90.0))
+        self.assertEqual(self.client.get("/api/portfolio_summary/", {"customer_id": "x"}).status_code, 400)
+
+    def test_catch_up_is_bounded(self):
+        from .snapshot import LoanSnapshot
+        snapshot = LoanSnapshot.build()
+        loans = [Loan.objects.create(customer_id=1, loan_id=loan_id, loan_amount=1000, tenure=1, interest_rate=10,
+                                     monthly_payment=90, emis_paid_on_time=0,
+                                     date_of_approval=date.today(), end_date=date.today())
+                 for loan_id in (1, 2, 3)]
+        record_changes([loan_change(loan) for loan in loans])
+
+        partial, caught_up = snapshot.refreshed(2)
+        self.assertFalse(caught_up)
+        self.assertEqual(partial.delta_size, 2)
+        full, caught_up = partial.refreshed(2)
+        self.assertTrue(caught_up)
+        self.assertEqual(full.customer_aggregates(1)["no_of_loans_taken"], 3)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.enterContext(override_settings(CHUNKED_UPLOAD_DIR=self.root))
+        self.ingested = []
+        self.enterContext(mock.patch.dict("predication.chunked_upload.INGESTERS", {"loan": self.ingest}))
+        self.ingest_result = ({"message": "ok"}, 201)
+        self.upload_id = self.client.post("/api/uploads/", json.dumps({"kind": "loan", "filename": "loans.xlsx"}),
+                                          content_type="application/json").json()["upload_id"]
+
+    def ingest(self, path):
+        with open(path, "rb") as f:
+            self.ingested.append(f.read())
+        if isinstance(self.ingest_result, Exception):
+            raise self.ingest_result
+        return self.ingest_result
+
+    def put(self, number, data, checksum=None):
+        return self.client.put(f"/api/uploads/{self.upload_id}/parts/{number}/", data,
+                               content_type="application/octet-stream",
+                               HTTP_X_PART_SHA256=checksum or hashlib.sha256(data).hexdigest())
+
+    def complete(self, total_parts, **extra):
+        return self.client.post(f"/api/uploads/{self.upload_id}/complete/",
+                                json.dumps({"total_parts": total_parts, **extra}), content_type="application/json")
+
+    def status(self):
+        return self.client.get(f"/api/uploads/{self.upload_id}/").json()
+
+    def test_out_of_order_parts_are_assembled_in_order(self):
+        self.assertEqual(self.put(3, b"ccc").status_code, 200)
+        self.assertEqual(self.put(2, b"bb").status_code, 200)
+        self.assertEqual(self.status()["assembled_parts"], 0)
+        self.put(1, b"a")
+        self.assertEqual(self.status()["assembled_parts"], 3)
+
+        response = self.complete(3, sha256=hashlib.sha256(b"abbccc").hexdigest())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.ingested, [b"abbccc"])
+        self.assertFalse((self.root / uuid.UUID(self.upload_id).hex).exists())
+
+    def test_checksum_mismatch(self):
+        response = self.put(1, b"abc", checksum=hashlib.sha256(b"abd").hexdigest())
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.status()["pending_parts"], [])
+        self.assertEqual(self.status()["assembled_parts"], 0)
+
+    def test_resume_from_status(self):
+        self.put(1, b"a")
+        self.put(3, b"c")
+        status = self.status()
+        self.assertEqual((status["assembled_parts"], status["pending_parts"]), (1, [3]))
+        self.assertEqual(self.complete(3).status_code, 409)
+
+        # The client re-sends only the missing part
+        self.put(2, b"b")
+        self.assertEqual(self.complete(3).status_code, 201)
+        self.assertEqual(self.ingested, [b"abc"])
+
+    def test_second_complete_while_ingesting(self):
+        from .chunked_upload import ChunkedUploadError, complete_upload
+        self.put(1, b"a")
+        nested = []
+
+        def ingest(path):
+            try:
+                complete_upload(uuid.UUID(self.upload_id), 1)
+            except ChunkedUploadError as e:
+                nested.append(e.status)
+            return {"message": "ok"}, 201
+
+        with mock.patch.dict("predication.chunked_upload.INGESTERS", {"loan": ingest}):
+            self.assertEqual(self.complete(1).status_code, 201)
+        self.assertEqual(nested, [409])
+
+    def test_failed_ingest_resets_state(self):
+        self.put(1, b"a")
+        self.ingest_result = ({"error": "bad row"}, 400)
+        self.assertEqual(self.complete(1).status_code, 400)
+        self.assertEqual(self.status()["state"], "assembled")
+
+        self.ingest_result = ValueError("unreadable")
+        self.assertEqual(self.complete(1).status_code, 400)
+        self.assertEqual(self.status()["state"], "assembled")
+
+        self.ingest_result = ({"message": "ok"}, 201)
+        self.assertEqual(self.complete(1).status_code, 201)
+        self.assertEqual(len(self.ingested), 3)
+
+    def test_ingest_left_by_dead_worker_can_be_completed(self):
+        self.put(1, b"a")
+        # A worker that died mid-ingest leaves the state behind, but no lock
+        path = self.root / uuid.UUID(self.upload_id).hex
+        manifest = json.loads((path / "manifest.json").read_text())
+        (path / "manifest.json").write_text(json.dumps({**manifest, "state": "ingesting"}))
+
+        self.assertEqual(self.status()["state"], "assembled")
+        self.assertEqual(self.put(2, b"b").status_code, 200)
+        self.assertEqual(self.complete(2).status_code, 201)
+        self.assertEqual(self.ingested, [b"ab"])
+
+    def test_part_uploads_are_gated(self):
+        from .middleware import get_gates
+        gate = get_gates()["chunked_upload_part"]
+        held = 0
+        while gate.acquire() is None:
+            held += 1
+        try:
+            response = self.put(1, b"a")
+        finally:
+            for _ in range(held):
+                gate.release()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(self.put(1, b"a").status_code, 200)
+
+    def test_held_lock_is_never_broken(self):
+        from .chunked_upload import ChunkedUploadError, _locked
+        path = self.root / uuid.UUID(self.upload_id).hex
+        with _locked(path):
+            # However old the lock file looks, a second holder only waits
+            os.utime(path / "lock", (0, 0))
+            with self.assertRaises(ChunkedUploadError) as cm:
+                with _locked(path, timeout=0.1):
+                    pass
+            self.assertEqual(cm.exception.status, 409)
+        with _locked(path, timeout=0.1):
+            pass
@@ -9,5 +9,14 @@ urlpatterns = [
     path('create_new_loan/', views.create_new_loan, name='create_new_loan'),  
     path('view_loan/loanid/<int:loan_id>/', views.view_loan_against_loan_id, name='view_loan_loan_id'),  
     path('view_loan/customerid/<int:customer_id>/', views.view_loan_against_customer_id, name='view_loan_against_customer_id'),  
+    path('customers/<int:customer_id>/summary/', views.customer_summary, name='customer_summary'),
+    path('changes/', views.list_changes, name='list_changes'),
+    path('stress_test/', views.stress_test, name='stress_test'),
+    path('admission_stats/', views.admission_stats, name='admission_stats'),
+    path('portfolio_summary/', views.portfolio_summary, name='portfolio_summary'),
+    path('uploads/', views.chunked_upload_init, name='chunked_upload_init'),
+    path('uploads/<uuid:upload_id>/', views.chunked_upload_status, name='chunked_upload_status'),
+    path('uploads/<uuid:upload_id>/parts/<int:part_number>/', views.chunked_upload_part, name='chunked_upload_part'),
+    path('uploads/<uuid:upload_id>/complete/', views.chunked_upload_complete, name='chunked_upload_complete'),
 ]
 
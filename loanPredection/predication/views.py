@@ -1,38 +1,71 @@
-import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.http import JsonResponse
-from .models import Loan, Customer
+from .models import Loan, Customer, ChangeEvent
+from .changes import loan_change, customer_change, record_changes, event_to_dict
+from .ingestion import ingest_loan_file, ingest_customer_file
+from .chunked_upload import ChunkedUploadError, init_upload, store_part, upload_status, complete_upload
+from .idempotency import idempotent
 from django.views.decorators.csrf import csrf_exempt
-import openpyxl
 import json
 from datetime import date, timedelta   
 import random
 from io import BytesIO
 
 
+# Credit score from the customer's loan history; 0 once the loans exceed the approved limit
+def calculate_credit_score(past_loans_paid_on_time, no_of_loans_taken, loan_activity_current_year,
+                           loan_approved_volume, total_current_loans, approved_limit):
+    if total_current_loans > float(approved_limit):
+        return 0
+    return (
+        past_loans_paid_on_time * 0.4 +
+        no_of_loans_taken * 0.3 +
+        loan_activity_current_year * 0.2 +
+        loan_approved_volume * 0.1
+    )
+
+
+def _loan_subquery(aggregate, output_field, **filters):
+    loans = Loan.objects.filter(customer_id=OuterRef("customer_id"), **filters).order_by().values("customer_id")
+    return Coalesce(Subquery(loans.annotate(total=aggregate).values("total")), Value(0), output_field=output_field)
+
+
+# Customers annotated with the credit score components of their loans, so a
+# customer and their score come back in a single query
+def customers_with_credit_aggregates(year):
+    return Customer.objects.annotate(
+        past_loans_paid_on_time=_loan_subquery(Sum("emis_paid_on_time"), IntegerField()),
+        no_of_loans_taken=_loan_subquery(Count("id"), IntegerField()),
+        loan_activity_current_year=_loan_subquery(Count("id"), IntegerField(), date_of_approval__year=year),
+        loan_approved_volume=_loan_subquery(Sum("loan_amount"), DecimalField(max_digits=15, decimal_places=2)),
+    )
+
+
+# Credit score of a customer fetched through customers_with_credit_aggregates
+def credit_score_of(customer):
+    loan_approved_volume = float(customer.loan_approved_volume)
+    return calculate_credit_score(
+        customer.past_loans_paid_on_time, customer.no_of_loans_taken, customer.loan_activity_current_year,
+        loan_approved_volume, loan_approved_volume, customer.approved_limit,
+    )
+
+
+# Number of monthly EMIs still due on a loan
+def calculate_repayments_left(loan, today):
+    months_since_approval = (today.year - loan.date_of_approval.year) * 12 + (today.month - loan.date_of_approval.month)
+    return max(loan.tenure * 12 - months_since_approval, 0)
+
+
 @csrf_exempt
 def upload_loan_data(request):
     if request.method == "POST" and request.FILES.get("file"):
         file = request.FILES["file"]
         try:
-            # Load the Excel file
-            df = pd.read_excel(file)
-
-            # Iterate over rows and save each record to the database
-            for _, row in df.iterrows():
-                _, created = Loan.objects.get_or_create(
-                    loan_id=row["Loan ID"],  # Use loan_id as the unique identifier
-                    defaults={
-                        "customer_id": row["Customer ID"],
-                        "loan_amount": row["Loan Amount"],
-                        "tenure": row["Tenure"],
-                        "interest_rate": row["Interest Rate"],
-                        "monthly_payment": row["Monthly payment"],
-                        "emis_paid_on_time": row["EMIs paid on Time"],
-                        "date_of_approval": row["Date of Approval"],
-                        "end_date": row["End Date"],
-                    },
-                )
-            return JsonResponse({"message": "Data uploaded successfully"}, status=201)
+            response_data, status_code = ingest_loan_file(file)
+            return JsonResponse(response_data, status=status_code)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=400)
     return JsonResponse({"error": "Invalid request"}, status=400)
@@ -56,64 +89,7 @@ def upload_customer_data(request):
                     'error': 'Invalid file format. Please upload an Excel file (.xls or .xlsx)'
                 }, status=400)
 
-            # Load the Excel file
-            wb = openpyxl.load_workbook(excel_file)
-            sheet = wb.active
-
-            # Get headers to verify column names
-            headers = [cell.value for cell in sheet[1]]
-            required_columns = ['Customer ID', 'First Name', 'Last Name', 'Age', 
-                              'Phone Number', 'Monthly Salary', 'Approved Limit']
-            
-            # Verify all required columns are present
-            missing_columns = [col for col in required_columns if col not in headers]
-            if missing_columns:
-                return JsonResponse({
-                    'error': f'Missing required columns: {", ".join(missing_columns)}'
-                }, status=400)
-
-            # Track successful and failed records
-            success_count = 0
-            failed_records = []
-
-            # Skip the header row and iterate through the data
-            for row_num, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), 2):
-                try:
-                    customer_id, first_name, last_name, age, phone_number, monthly_salary, approved_limit = row
-                    
-                    # Basic validation
-                    if not all([first_name, last_name, age, phone_number, monthly_salary]):
-                        failed_records.append(f"Row {row_num}: Missing required fields")
-                        continue
-
-                    # Create or update customer
-                    Customer.objects.update_or_create(
-                        phone_number=phone_number,  # Using phone_number as unique identifier
-                        defaults={
-                            'first_name': first_name,
-                            'last_name': last_name,
-                            'age': age,
-                            'monthly_salary': monthly_salary,
-                            'approved_limit': approved_limit if approved_limit else round((36 * float(monthly_salary)) / 100000) * 100000,
-                        }
-                    )
-                    success_count += 1
-
-                except Exception as e:
-                    failed_records.append(f"Row {row_num}: {str(e)}")
-
-            # Prepare response
-            response_data = {
-                'message': f'Successfully processed {success_count} records',
-                'total_rows': sheet.max_row - 1,  # Excluding header
-                'successful_records': success_count,
-                'failed_records': len(failed_records),
-            }
-            
-            if failed_records:
-                response_data['errors'] = failed_records
-
-            status_code = 200 if success_count > 0 else 400
+            response_data, status_code = ingest_customer_file(excel_file)
             return JsonResponse(response_data, status=status_code)
 
         except Exception as e:
@@ -126,6 +102,7 @@ def upload_customer_data(request):
 
 # function to register a new customer 
 @csrf_exempt
+@idempotent
 def add_customer(request):  
     if request.method == "POST":
         try:
@@ -157,14 +134,16 @@ def add_customer(request):
             approved_limit = round((36 * float(monthly_income)) / 100000) * 100000
 
             # Create new customer in the database
-            customer = Customer.objects.create(
-                first_name=first_name,
-                last_name=last_name,
-                age=age,
-                monthly_salary=monthly_income,
-                phone_number=phone_number,
-                approved_limit=approved_limit
-            )
+            with transaction.atomic():
+                customer = Customer.objects.create(
+                    first_name=first_name,
+                    last_name=last_name,
+                    age=age,
+                    monthly_salary=monthly_income,
+                    phone_number=phone_number,
+                    approved_limit=approved_limit
+                )
+                record_changes([customer_change(customer)])
 
             # Return success response with required fields
             return JsonResponse({
@@ -228,39 +207,18 @@ def loan_eligibility(request):
                             "tenure: integer"
                 }, status=400)
 
-            # Fetch customer details
+            # Fetch customer details along with the credit score components
+            # of their loans, read from the database so a decision always
+            # sees the customer's latest loans
             try:
-                customer = Customer.objects.get(customer_id=customer_id)
+                customer = customers_with_credit_aggregates(date.today().year).get(customer_id=customer_id)
             except Customer.DoesNotExist:
                 return JsonResponse({
                     "error": f"Customer with ID {customer_id} not found"
                 }, status=404)
 
-            # Get all loans for this customer
-            customer_loans = Loan.objects.filter(customer_id=customer_id)
-            
-            # Calculate credit score components
-            past_loans_paid_on_time = sum(loan.emis_paid_on_time for loan in customer_loans)
-            no_of_loans_taken = customer_loans.count()
-            current_year = date.today().year
-            loan_activity_current_year = customer_loans.filter(
-                date_of_approval__year=current_year
-            ).count()
-            loan_approved_volume = sum(float(loan.loan_amount) for loan in customer_loans)
-
-            # Calculate total current loans
-            total_current_loans = sum(float(loan.loan_amount) for loan in customer_loans)
-
             # Credit score calculation
-            if total_current_loans > float(customer.approved_limit):
-                credit_score = 0
-            else:
-                credit_score = (
-                    past_loans_paid_on_time * 0.4 +
-                    no_of_loans_taken * 0.3 +
-                    loan_activity_current_year * 0.2 +
-                    loan_approved_volume * 0.1
-                )
+            credit_score = credit_score_of(customer)
 
             # Determine approval status and adjusted interest rate
             corrected_interest_rate = interest_rate
@@ -311,6 +269,7 @@ def loan_eligibility(request):
 # creating a new loan against a a customer
 
 @csrf_exempt
+@idempotent
 def create_new_loan(request):
     if request.method == "POST":
         try:
@@ -394,17 +353,19 @@ def create_new_loan(request):
                         break
 
                 # Create and save new loan
-                new_loan = Loan.objects.create(
-                    customer_id=customer_id,
-                    loan_id=loan_id,
-                    loan_amount=loan_amount,
-                    tenure=tenure,
-                    interest_rate=eligibility_result.get("corrected_interest_rate", interest_rate),
-                    monthly_payment=eligibility_result.get("monthly_installment", 0),
-                    emis_paid_on_time=0,
-                    date_of_approval=date.today(),
-                    end_date=date.today() + timedelta(days=tenure * 365)
-                )
+                with transaction.atomic():
+                    new_loan = Loan.objects.create(
+                        customer_id=customer_id,
+                        loan_id=loan_id,
+                        loan_amount=loan_amount,
+                        tenure=tenure,
+                        interest_rate=eligibility_result.get("corrected_interest_rate", interest_rate),
+                        monthly_payment=eligibility_result.get("monthly_installment", 0),
+                        emis_paid_on_time=0,
+                        date_of_approval=date.today(),
+                        end_date=date.today() + timedelta(days=tenure * 365)
+                    )
+                    record_changes([loan_change(new_loan)])
 
                 return JsonResponse({
                     "loan_id": new_loan.loan_id,
@@ -485,17 +446,12 @@ def view_loan_against_customer_id(request, customer_id):
             # Prepare the response data
             loan_items = []
             for loan in loans:
-                # Calculate repayments left
-                today = date.today()
-                months_since_approval = (today.year - loan.date_of_approval.year) * 12 + (today.month - loan.date_of_approval.month)
-                repayments_left = max(loan.tenure * 12 - months_since_approval, 0)
-
                 loan_items.append({
                     "loan_id": loan.loan_id,
                     "loan_amount": float(loan.loan_amount),
                     "interest_rate": loan.interest_rate,
                     "monthly_installment": float(loan.monthly_payment),
-                    "repayments_left": repayments_left
+                    "repayments_left": calculate_repayments_left(loan, date.today())
                 })
 
             return JsonResponse(loan_items, safe=False, status=200)
@@ -504,3 +460,262 @@ def view_loan_against_customer_id(request, customer_id):
             return JsonResponse({"error": str(e)}, status=500)
 
     return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+
+# change feed of loan / customer writes, read page by page with a cursor
+@csrf_exempt
+def list_changes(request):
+    if request.method == "GET":
+        try:
+            default_size = getattr(settings, "CHANGE_FEED_PAGE_SIZE", 100)
+            max_size = getattr(settings, "CHANGE_FEED_MAX_PAGE_SIZE", 1000)
+            try:
+                since = int(request.GET.get("since", 0))
+                limit = int(request.GET.get("limit", default_size))
+            except ValueError:
+                return JsonResponse({"error": "since and limit must be integers"}, status=400)
+            limit = max(1, min(limit, max_size))
+
+            events = ChangeEvent.objects.filter(id__gt=since)
+            table = request.GET.get("table")
+            if table:
+                events = events.filter(table=table)
+
+            # Fetch one extra row to know whether another page follows
+            page = list(events.order_by("id")[:limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit]
+
+            return JsonResponse({
+                "events": [event_to_dict(event) for event in page],
+                "next_cursor": page[-1].id if page else since,
+                "has_more": has_more,
+            }, status=200)
+
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+
+# portfolio stress test (Monte Carlo) over the whole loan book
+@csrf_exempt
+def stress_test(request):
+    if request.method == "GET":
+        try:
+            from .stress import load_book
+            from .stress_engine import DEFAULT_SCENARIO, run_stress_test
+
+            try:
+                scenario = {
+                    "paths": int(request.GET.get("paths", DEFAULT_SCENARIO["paths"])),
+                    "rate_shock_bps": float(request.GET.get("rate_shock_bps", DEFAULT_SCENARIO["rate_shock_bps"])),
+                    "default_multiplier": float(request.GET.get("default_multiplier", DEFAULT_SCENARIO["default_multiplier"])),
+                    "lgd": float(request.GET.get("lgd", DEFAULT_SCENARIO["lgd"])),
+                }
+                if "seed" in request.GET:
+                    scenario["seed"] = int(request.GET["seed"])
+            except ValueError:
+                return JsonResponse({"error": "Invalid scenario parameters"}, status=400)
+
+            max_paths = getattr(settings, "STRESS_TEST_MAX_PATHS", 5000)
+            if not 1 <= scenario["paths"] <= max_paths:
+                return JsonResponse({"error": f"paths must be between 1 and {max_paths}"}, status=400)
+            if not 0 <= scenario["lgd"] <= 1:
+                return JsonResponse({"error": "lgd must be between 0 and 1"}, status=400)
+            if scenario["default_multiplier"] < 0:
+                return JsonResponse({"error": "default_multiplier must not be negative"}, status=400)
+
+            result = run_stress_test(load_book(), scenario,
+                                     workers=getattr(settings, "STRESS_TEST_WORKERS", None))
+            return JsonResponse(result, status=200)
+
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+
+# queue depth and rejection counts of the admission-control gates
+@csrf_exempt
+def admission_stats(request):
+    if request.method == "GET":
+        from .middleware import get_gates
+        return JsonResponse({route: gate.stats() for route, gate in get_gates().items()}, status=200)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+
+# aggregate figures for the whole loan book, or with ?customer_id= one
+# customer's exposure and EMI totals, served from the in-memory snapshot
+@csrf_exempt
+def portfolio_summary(request):
+    if request.method == "GET":
+        try:
+            customer_id = request.GET.get("customer_id")
+            if customer_id is not None:
+                try:
+                    customer_id = int(customer_id)
+                except ValueError:
+                    return JsonResponse({"error": "customer_id must be an integer"}, status=400)
+
+            from .snapshot import get_snapshot
+            snapshot = get_snapshot()
+            if customer_id is not None:
+                return JsonResponse({
+                    "customer_id": customer_id,
+                    **snapshot.customer_aggregates(customer_id),
+                    "cursor": snapshot.cursor,
+                }, status=200)
+            return JsonResponse(snapshot.portfolio_summary(), status=200)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+
+# resumable chunked upload of the loan / customer workbooks
+@csrf_exempt
+def chunked_upload_init(request):
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+            return JsonResponse(init_upload(data.get("kind"), data.get("filename")), status=201)
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Invalid JSON data"}, status=400)
+        except ChunkedUploadError as e:
+            return JsonResponse({"error": str(e)}, status=e.status)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+@csrf_exempt
+def chunked_upload_status(request, upload_id):
+    if request.method == "GET":
+        try:
+            return JsonResponse(upload_status(upload_id), status=200)
+        except ChunkedUploadError as e:
+            return JsonResponse({"error": str(e)}, status=e.status)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+@csrf_exempt
+def chunked_upload_part(request, upload_id, part_number):
+    if request.method == "PUT":
+        try:
+            # The body is read from the stream straight to disk, never via request.body
+            try:
+                length = int(request.META.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                length = None
+            result = store_part(upload_id, part_number, request, length,
+                                request.headers.get("X-Part-SHA256"))
+            return JsonResponse(result, status=200)
+        except ChunkedUploadError as e:
+            return JsonResponse({"error": str(e)}, status=e.status)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+@csrf_exempt
+def chunked_upload_complete(request, upload_id):
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body or b"{}")
+            try:
+                total_parts = int(data.get("total_parts"))
+            except (TypeError, ValueError):
+                return JsonResponse({"error": "total_parts must be an integer"}, status=400)
+            response_data, status_code = complete_upload(upload_id, total_parts, data.get("sha256"))
+            return JsonResponse(response_data, status=status_code)
+        except json.JSONDecodeError:
+            return JsonResponse({"error": "Invalid JSON data"}, status=400)
+        except ChunkedUploadError as e:
+            return JsonResponse({"error": str(e)}, status=e.status)
+        except Exception as e:
+            return JsonResponse({"error": f"Error processing file: {str(e)}"}, status=400)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)
+
+
+
+# everything the customer view needs in one call: profile, active loans,
+# credit score components and headroom (two queries: the customer with their
+# loan aggregates, then the rows of their active loans)
+@csrf_exempt
+def customer_summary(request, customer_id):
+    if request.method == "GET":
+        try:
+            today = date.today()
+            try:
+                customer = customers_with_credit_aggregates(today.year).get(customer_id=customer_id)
+            except Customer.DoesNotExist:
+                return JsonResponse({
+                    "error": f"Customer with ID {customer_id} not found"
+                }, status=404)
+
+            loans = Loan.objects.filter(customer_id=customer_id, end_date__gte=today).only(
+                "loan_id", "loan_amount", "tenure", "interest_rate", "monthly_payment", "date_of_approval",
+            )
+
+            active_loans = []
+            for loan in loans:
+                repayments_left = calculate_repayments_left(loan, today)
+                if repayments_left > 0:
+                    active_loans.append({
+                        "loan_id": loan.loan_id,
+                        "loan_amount": float(loan.loan_amount),
+                        "interest_rate": loan.interest_rate,
+                        "monthly_installment": float(loan.monthly_payment),
+                        "repayments_left": repayments_left,
+                    })
+
+            approved_limit = float(customer.approved_limit)
+            monthly_salary = float(customer.monthly_salary)
+            active_loan_amount = sum(loan["loan_amount"] for loan in active_loans)
+            # The limit rule of the credit score (and so of eligibility)
+            # counts every loan the customer has taken, closed ones included
+            total_loan_amount = float(customer.loan_approved_volume)
+            current_emis = sum(loan["monthly_installment"] for loan in active_loans)
+
+            return JsonResponse({
+                "customer_id": customer.customer_id,
+                "first_name": customer.first_name,
+                "last_name": customer.last_name,
+                "age": customer.age,
+                "phone_number": customer.phone_number,
+                "monthly_income": monthly_salary,
+                "approved_limit": approved_limit,
+                "active_loans": active_loans,
+                "credit_score": {
+                    "score": credit_score_of(customer),
+                    "past_loans_paid_on_time": customer.past_loans_paid_on_time,
+                    "no_of_loans_taken": customer.no_of_loans_taken,
+                    "loan_activity_current_year": customer.loan_activity_current_year,
+                    "loan_approved_volume": float(customer.loan_approved_volume),
+                },
+                "headroom": {
+                    "total_loan_amount": total_loan_amount,
+                    "remaining_limit": approved_limit - total_loan_amount,
+                    "active_loan_amount": active_loan_amount,
+                    "current_monthly_installments": round(current_emis, 2),
+                    "remaining_monthly_installment": round(0.5 * monthly_salary - current_emis, 2),
+                },
+            }, status=200)
+
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=500)
+
+    return JsonResponse({"error": "Method not allowed"}, status=405)